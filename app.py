@@ -1,10 +1,16 @@
 import streamlit as st
 import pandas as pd
-from pypdf import PdfReader
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
-import re
+from llm_client import get_llm
+from metrics import MetricsStore, RECORDER, metric_labels, summarise, call_cost, prometheus_text
+from pipeline import ExtractionPool, ANALYSIS_MODES, PARSE_STATS, PAPER_FIELDS, LabelStreamParser, is_stale, estimate_analysis, extraction_budget, cached_source_text, text_profile, file_hash
+from jobs import JobQueue, JobWorker, ACTIVE_STATES
+from exports import papers_frame, EXPORT_FORMATS
+from ocr import OCRPool, OCR_AVAILABLE, OCR_PAGE_BUDGET
+from minhash import NEAR_DUPLICATE_THRESHOLD
+from synthesis import synthesize, parse_synthesis, SYNTH_PROMPT_VERSION, SYNTH_SECTIONS
+from store import ProjectStore, ExtractionCache, ConflictError, DB_FILE, LEGACY_JSON_FILE, CACHE_FILE, METRICS_FILE
 import json
+import hashlib
 import os
 import time
 from datetime import datetime
@@ -13,27 +19,195 @@ from datetime import datetime
 st.set_page_config(page_title="Literature Review Buddy", page_icon="📚", layout="wide")
 
 # 2. STORAGE SETUP
-DB_FILE = "buddy_projects.json"
-
-def load_data():
-    if os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, "r") as f:
-                data = json.load(f)
-                new_data = {}
-                for k, v in data.items():
-                    if isinstance(v, list):
-                        new_data[k] = {"papers": v, "last_accessed": 0}
-                    else:
-                        new_data[k] = v
-                return new_data
-        except:
-            return {}
-    return {}
+MODEL_NAME = "gemini-2.0-flash"
+
+@st.cache_resource
+def get_store():
+    # Shared by all sessions; imports buddy_projects.json on first start
+    return ProjectStore(DB_FILE, legacy_json=LEGACY_JSON_FILE)
+
+@st.cache_resource
+def get_extraction_cache():
+    return ExtractionCache(CACHE_FILE)
+
+@st.cache_resource
+def get_extraction_pool():
+    # One pool per server so concurrent sessions share a fixed number of parser processes
+    return ExtractionPool(
+        workers=int(st.secrets.get("PDF_WORKERS", os.cpu_count() or 1)),
+        timeout=int(st.secrets.get("PDF_TIMEOUT_S", 120)),
+        mem_limit_mb=int(st.secrets.get("PDF_MEMORY_MB", 1024)),
+    )
+
+@st.cache_resource
+def get_ocr_pool():
+    # Scanned PDFs only; the Tesseract processes are spawned the first time one arrives
+    if not OCR_AVAILABLE:
+        return None
+    return OCRPool(workers=int(st.secrets.get("OCR_WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+                   page_budget=int(st.secrets.get("OCR_PAGE_BUDGET", OCR_PAGE_BUDGET)), lang=st.secrets.get("OCR_LANG", "eng"))
+
+@st.cache_resource
+def get_metrics_store():
+    # Model calls and PDF extractions from every session and worker are recorded here
+    return RECORDER.attach(MetricsStore(METRICS_FILE))
+
+def shared_llm():
+    # One client per (model, temperature, key) for the whole server; calls share a global concurrency cap
+    return get_llm(MODEL_NAME, st.secrets.get("GEMINI_API_KEY"), temperature=0.1,
+                   max_concurrency=int(st.secrets.get("LLM_GLOBAL_CONCURRENCY", 8)))
+
+@st.cache_resource
+def get_job_worker():
+    # Ingestion runs on server-owned threads, so it outlives reruns, navigation and closed tabs
+    # One thread per model-call slot: each thread runs one job at a time, so fewer threads would leave slots idle
+    concurrency = int(st.secrets.get("LLM_CONCURRENCY", 4))
+    worker = JobWorker(
+        shared_llm(), get_store(), JobQueue(DB_FILE),
+        workers=int(st.secrets.get("JOB_WORKERS", concurrency)), concurrency=concurrency,
+        near_duplicate_threshold=float(st.secrets.get("NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD)),
+        cache=get_extraction_cache(), model=MODEL_NAME, extractor=get_extraction_pool(), ocr=get_ocr_pool(), stream=True,
+    )
+    return worker.start()
+
+PAPER_SECTIONS = [("📝 Summary", "Summary"), ("📖 Background", "Background"), ("⚙️ Methodology", "Methodology"), ("📍 Context", "Context"), ("💡 Findings", "Findings"), ("🛡️ Reliability", "Reliability")]
+SYNTH_HEADINGS = {"OVERVIEW": "### 🎯 Executive Overview", "PATTERNS": "### 📈 Cross-Study Patterns",
+                  "CONTRADICTIONS": "### ⚖️ Conflicts & Contradictions", "FUTURE": "### 🚀 Future Research Directions"}
+
+def streaming_preview(job):
+    # The worker streams the model's reply into the job row; sections appear as their labels arrive
+    fields = LabelStreamParser([label for label, _ in PAPER_FIELDS]).update(job["partial"])
+    labels = {key: label for label, key in PAPER_FIELDS}
+    with st.container(border=True):
+        st.markdown(f'**✍️ {fields.get("TITLE") or job["name"]}**')
+        if fields.get("AUTHORS") or fields.get("YEAR"):
+            st.markdown(f'🖊️ Authors: {fields.get("AUTHORS", "…")} | 🗓️ Year: {fields.get("YEAR", "…")}')
+        for title, key in PAPER_SECTIONS:
+            if fields.get(labels[key]):
+                st.markdown(f'<span class="section-title">{title}</span><span class="section-content">{fields[labels[key]]}</span>', unsafe_allow_html=True)
+
+def job_status_panel(project_id, revision, was_active):
+    # Rendered as a fragment that polls every second while jobs are active
+    queue = get_job_worker().queue
+    jobs = queue.project_jobs(project_id)
+    if jobs:
+        active = sum(j["state"] in ACTIVE_STATES for j in jobs)
+        with st.expander(f"⚙️ Analysis queue · {active} in progress", expanded=bool(active)):
+            icons = {"queued": "⏳", "extracting": "📖", "analysing": "🔬", "done": "✅", "failed": "❌", "cancelled": "⏹️", "near-duplicate": "👯"}
+            rows = [{
+                "File": j["name"], "State": f'{icons.get(j["state"], "")} {j["state"]}', "Attempts": j["attempts"],
+                "Pages read": f'{j["timings"]["pages_read"]}/{j["timings"]["pages_total"]}' if j["timings"] else "",
+                "Extract (s)": round(j["timings"]["open_s"] + j["timings"]["extract_s"], 2) if j["timings"] else None,
+                "OCR": f'{j["timings"]["ocr_pages"]} pages · p50 {j["timings"]["ocr_page_p50_s"]:.1f}s/page' if j["timings"].get("ocr_pages") else "",
+                "Note": j["error"] or j["note"] or "",
+            } for j in jobs]
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+            for j in jobs:
+                if j["state"] == "analysing" and j["partial"]:
+                    streaming_preview(j)
+                if j["state"] in ACTIVE_STATES and st.button(f"⏹️ Cancel {j['name']}", key=f"cancel_job_{j['id']}"):
+                    # Stops the model stream at its next chunk, so the rest of the reply is not generated
+                    get_job_worker().cancel(j["id"]); st.rerun()
+                if j["state"] in ("failed", "cancelled") and st.button(f"🔁 Retry {j['name']}", key=f"retry_job_{j['id']}"):
+                    queue.retry(j["id"]); get_job_worker().notify(); st.rerun()
+                if j["state"] == "near-duplicate" and st.button(f"➕ Analyse {j['name']} anyway", key=f"keep_job_{j['id']}"):
+                    queue.retry(j["id"], allow_near_duplicate=True); get_job_worker().notify(); st.rerun()
+                if j["state"] in ("failed", "cancelled") and st.button(f"🗑️ Dismiss {j['name']}", key=f"dismiss_job_{j['id']}"):
+                    queue.dismiss(j["id"]); st.rerun()
+            if st.button("🧹 Clear finished", key="clear_finished_jobs"):
+                queue.clear_finished(project_id); st.rerun()
+            st.caption("Response parsing since server start: " + ", ".join(f"{k} {v}" for k, v in PARSE_STATS.items()))
+    # New papers were committed by a worker, or the queue drained: rerun the whole page so the tabs
+    # pick them up and the synthesis, held back while jobs run, is brought up to date
+    if get_store().project_revision(project_id) != revision or (was_active and not queue.active_count(project_id)):
+        st.rerun()
+
+DIAGNOSTIC_WINDOWS = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400, "Last 30 days": 30 * 86400}
+
+def diagnostics_page(project_names):
+    st.markdown('<h1 style="margin:0; font-size: 2.5rem; color:#0000FF;">📈 Diagnostics</h1>', unsafe_allow_html=True)
+    c_window, c_back = st.columns([4, 1])
+    window = c_window.selectbox("Window", list(DIAGNOSTIC_WINDOWS), index=1, label_visibility="collapsed")
+    if c_back.button("🏠 Library", use_container_width=True):
+        st.session_state.show_diagnostics = False; st.rerun()
+    metrics_store = get_metrics_store()
+    events = metrics_store.events(since=time.time() - DIAGNOSTIC_WINDOWS[window])
+    llm_events = [e for e in events if e["kind"] == "llm"]
+    pdf_events = [e for e in events if e["kind"] == "pdf"]
+    if not events:
+        st.info("No model calls or PDF extractions recorded in this window.")
+    else:
+        total = summarise(llm_events, key="kind")[0] if llm_events else None
+        m1, m2, m3, m4, m5 = st.columns(5)
+        m1.metric("Model requests", total["calls"] if total else 0, f'{total["errors"] if total else 0} errors', delta_color="inverse")
+        m2.metric("p50 / p95 latency", f'{total["p50_s"]:.1f}s / {total["p95_s"]:.1f}s' if total and total["p50_s"] is not None else "–")
+        m3.metric("Retries", total["retries"] if total else 0)
+        m4.metric("Tokens in / out", f'{total["input_tokens"]:,} / {total["output_tokens"]:,}' if total else "–")
+        m5.metric("Estimated cost", f'${total["cost_usd"]:.4f}' if total else "–")
+
+        st.markdown("### Throughput")
+        df = pd.DataFrame(events)
+        df["time"] = pd.to_datetime(df["time"], unit="s")
+        bucket = "1min" if DIAGNOSTIC_WINDOWS[window] <= 3600 else "1h" if DIAGNOSTIC_WINDOWS[window] <= 86400 else "1D"
+        st.line_chart(df.groupby([pd.Grouper(key="time", freq=bucket), "kind"]).size().unstack(fill_value=0))
+
+        st.markdown("### Latency by operation")
+        rows = summarise(llm_events) + summarise(pdf_events)
+        st.dataframe(pd.DataFrame(rows).rename(columns={"operation": "Operation", "calls": "Calls", "errors": "Errors", "retries": "Retries",
+                     "p50_s": "p50 (s)", "p95_s": "p95 (s)", "input_tokens": "Tokens in", "output_tokens": "Tokens out",
+                     "pages": "Pages", "cost_usd": "Cost (USD)"}), hide_index=True, use_container_width=True)
+
+        st.markdown("### Cost by project")
+        costs = summarise(llm_events, key="project_id")
+        for row in costs:
+            row["project_id"] = project_names.get(row["project_id"], "(no project)" if row["project_id"] == "" else f'#{row["project_id"]} (deleted)')
+        if costs:
+            st.dataframe(pd.DataFrame(costs)[["project_id", "calls", "input_tokens", "output_tokens", "cost_usd"]].rename(columns={
+                         "project_id": "Project", "calls": "Requests", "input_tokens": "Tokens in", "output_tokens": "Tokens out",
+                         "cost_usd": "Cost (USD)"}), hide_index=True, use_container_width=True)
+        else:
+            # e.g. only malformed PDFs, scans without OCR or held near-duplicates, which never reach the model
+            st.caption("No model calls in this window.")
+    st.download_button("⬇️ Prometheus metrics", lambda: prometheus_text(metrics_store.events()), "metrics.prom", mime="text/plain")
+    st.caption("For scraping, run `python metrics.py --port 9464` next to the app and point Prometheus at /metrics.")
+
+def show_conflict_notice():
+    # Conflicts are usually followed by a rerun, so the message is parked in the session and shown once
+    if "conflict_notice" in st.session_state:
+        st.warning(st.session_state.pop("conflict_notice"), icon="⚠️")
+
+# Table and export bytes are keyed on (project id, revision); revision is bumped on every add/delete
+@st.cache_data(max_entries=64, show_spinner=False)
+def project_table(project_id, revision, _papers):
+    return papers_frame(_papers)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def project_export(project_id, revision, fmt, _papers):
+    return EXPORT_FORMATS[fmt][3](project_table(project_id, revision, _papers))
 
-def save_data(data):
-    with open(DB_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+@st.cache_data(max_entries=64, show_spinner=False)
+def reanalysis_estimate(project_id, revision, mode, _papers):
+    # Stale papers that can be re-run from cached text, with the expected calls, tokens and cost. Papers whose
+    # cached text is shorter than the mode reads (truncated, for chunked mode) need their PDF again
+    cache, budget = get_extraction_cache(), extraction_budget(mode)
+    runnable, calls, tokens_in, tokens_out = [], 0, 0, 0
+    for p in _papers:
+        if not is_stale(p, mode, MODEL_NAME) or not p.get("_source_hash"):
+            continue
+        profile = p.get("_text_profile") or ""
+        skip = profile.endswith("-nobackmatter")
+        text, used = cached_source_text(cache, p["_source_hash"], budget, skip, p.get("_text_profile"))
+        if text and used == text_profile(budget, skip):
+            runnable.append(p["_id"])
+            c, i, o = estimate_analysis(text, mode)
+            calls, tokens_in, tokens_out = calls + c, tokens_in + i, tokens_out + o
+    cost = call_cost({"model": MODEL_NAME, "input_tokens": tokens_in, "output_tokens": tokens_out})
+    return {"paper_ids": runnable, "calls": calls, "input_tokens": tokens_in, "output_tokens": tokens_out, "cost_usd": cost}
+
+def synthesis_key(papers):
+    # Any add/delete/edit of a paper changes the hash and invalidates the cached synthesis
+    digest = hashlib.sha256(json.dumps(papers, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{SYNTH_PROMPT_VERSION}:{MODEL_NAME}:{digest}"
 
 # 3. STYLING (Green/Blue Branding)
 st.markdown("""
@@ -143,46 +317,82 @@ def check_password():
 
 # 5. MAIN LOGIC
 if check_password():
-    api_key = st.secrets.get("GEMINI_API_KEY")
+    store = get_store()
+    get_metrics_store()
+    get_job_worker()  # jobs left queued or interrupted by a restart resume without waiting for a project to be opened
 
-    if 'projects' not in st.session_state:
-        st.session_state.projects = load_data()
+    if 'open_project' not in st.session_state:
+        st.session_state.open_project = None
     if 'active_project' not in st.session_state:
         st.session_state.active_project = None 
     if 'renaming_project' not in st.session_state:
         st.session_state.renaming_project = None
 
-    if st.session_state.active_project is None:
+    if st.session_state.get("show_diagnostics"):
+        diagnostics_page({p["id"]: name for name, p in store.project_index().items()})
+
+    elif st.session_state.active_project is None:
         # LIBRARY VIEW
+        # Only the project index is read here; an opened project's papers are dropped from the session on return
+        st.session_state.open_project = None
+        project_index = store.project_index()
         st.markdown('<div><h1 style="margin:0; font-size: 2.5rem; color:#0000FF;">🗂️ Project Library</h1><p style="color:#18A48C; font-weight: bold; font-size: 1.1rem; margin-bottom: 1.25rem;">Select an existing review or start a new one</p></div>', unsafe_allow_html=True)
+        show_conflict_notice()
+        if store.legacy_error:
+            c_err, c_retry = st.columns([4, 1])
+            c_err.error(store.legacy_error, icon="🚨")
+            if c_retry.button("🔁 Retry import", use_container_width=True):
+                store.retry_legacy_import(); st.rerun()
 
         with st.container(border=True):
             c1, c2 = st.columns([4, 1])
             new_name = c1.text_input("New Project Name", placeholder="e.g. AI Ethics 2026", label_visibility="collapsed")
             if c2.button("➕ Create Project", use_container_width=True):
-                if new_name and new_name not in st.session_state.projects:
-                    st.session_state.projects[new_name] = {"papers": [], "last_accessed": time.time()}
-                    save_data(st.session_state.projects)
-                    st.session_state.active_project = new_name
-                    st.rerun()
-                elif new_name in st.session_state.projects:
+                if new_name and new_name not in project_index:
+                    try:
+                        store.create_project(new_name)
+                    except ConflictError as e:  # Created by another session since the index was read
+                        st.error(str(e))
+                    else:
+                        st.session_state.active_project = new_name
+                        st.rerun()
+                elif new_name in project_index:
                     st.error("Project already exists.")
 
-        projects = list(st.session_state.projects.keys())
-        if projects:
-            sorted_projects = sorted(projects, key=lambda k: st.session_state.projects[k].get("last_accessed", 0) if isinstance(st.session_state.projects[k], dict) else 0, reverse=True)
+        if store.search_enabled:
+            lib_query = st.text_input("Search all papers", placeholder="🔎 Search every project's papers by title, author, year or findings", label_visibility="collapsed", key="library_query")
+            if lib_query.strip():
+                search_start = time.perf_counter()
+                hits = store.search(lib_query)
+                st.caption(f"{len(hits)} matching paper(s){' (top 50)' if len(hits) == 50 else ''} · {(time.perf_counter() - search_start) * 1000:.0f} ms")
+                for hit in hits:
+                    with st.container(border=True):
+                        c_hit, c_go = st.columns([8, 0.5])
+                        c_hit.markdown(f"**{hit['Title'] or 'Untitled'}** · 🖊️ {hit['Authors'] or 'N/A'} · 🗓️ {hit['Year'] or 'N/A'} · 🗂️ {hit['project']}  \n{hit['snippet']}")
+                        if c_go.button("➡️", key=f"open_hit_{hit['paper_id']}"):
+                            st.session_state.active_project = hit["project"]
+                            st.session_state.papers_query = hit["Title"] or ""
+                            store.touch_project(hit["project"])
+                            st.rerun()
+
+        if project_index:
             st.markdown("### Your Projects")
-            for proj_name in sorted_projects:
+            for proj_name, proj_data in project_index.items():
                 with st.container(border=True):
                     if st.session_state.renaming_project == proj_name:
                         r_col1, r_col2, r_col3 = st.columns([6, 1, 1])
                         with r_col1: new_name_val = st.text_input("Rename", value=proj_name, label_visibility="collapsed", key=f"input_{proj_name}")
                         with r_col2: 
                             if st.button("✅", key=f"save_rename_{proj_name}", use_container_width=True):
-                                st.session_state.projects[new_name_val] = st.session_state.projects.pop(proj_name)
-                                save_data(st.session_state.projects)
-                                st.session_state.renaming_project = None
-                                st.rerun()
+                                if new_name_val != proj_name and new_name_val in project_index:
+                                    st.error("Project already exists.")
+                                else:
+                                    try:
+                                        store.rename_project(proj_name, new_name_val)
+                                    except ConflictError as e:
+                                        st.session_state.conflict_notice = str(e)
+                                    st.session_state.renaming_project = None
+                                    st.rerun()
                         with r_col3:
                             if st.button("❌", key=f"cancel_rename_{proj_name}", use_container_width=True):
                                 st.session_state.renaming_project = None
@@ -190,8 +400,7 @@ if check_password():
                     else:
                         col_name, col_spacer, col_edit, col_del, col_open = st.columns([6, 1.5, 0.5, 0.5, 0.5])
                         with col_name:
-                            proj_data = st.session_state.projects[proj_name]
-                            p_count = len(proj_data["papers"]) if isinstance(proj_data, dict) else len(proj_data)
+                            p_count = proj_data["paper_count"]
                             st.markdown(f"<div style='display:flex; flex-direction:column; justify-content:center; height:100%;'><h3 style='margin:0; padding:0; font-size:1.1rem; color:#0000FF;'>{proj_name}</h3><span style='font-size:0.85rem; color:#666;'>📚 {p_count} Papers</span></div>", unsafe_allow_html=True)
                         with col_edit:
                             st.markdown('<div class="icon-btn">', unsafe_allow_html=True)
@@ -202,141 +411,197 @@ if check_password():
                         with col_del:
                             st.markdown('<div class="icon-btn">', unsafe_allow_html=True)
                             if st.button("🗑️", key=f"del_{proj_name}"):
-                                del st.session_state.projects[proj_name]
-                                save_data(st.session_state.projects)
+                                store.delete_project(proj_name)
                                 st.rerun()
                             st.markdown('</div>', unsafe_allow_html=True)
                         with col_open:
                             st.markdown('<div class="icon-btn">', unsafe_allow_html=True)
                             if st.button("➡️", key=f"open_{proj_name}"):
                                 st.session_state.active_project = proj_name
-                                st.session_state.projects[proj_name]["last_accessed"] = time.time()
-                                save_data(st.session_state.projects)
+                                store.touch_project(proj_name)
                                 st.rerun()
                             st.markdown('</div>', unsafe_allow_html=True)
 
+        if st.button("📈 Diagnostics"):
+            st.session_state.show_diagnostics = True; st.rerun()
+
     else:
         # PROJECT VIEW
         st.markdown(f'<div class="fixed-header-bg"><div class="fixed-header-text"><h1>{st.session_state.active_project}</h1></div></div>', unsafe_allow_html=True)
         st.markdown('<div class="upload-pull-up">', unsafe_allow_html=True)
         
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=api_key, temperature=0.1)
+        llm = shared_llm()
         
+        current_proj = st.session_state.open_project
+        if current_proj is None or current_proj["name"] != st.session_state.active_project or store.project_revision(current_proj["id"]) != current_proj["revision"]:
+            # Papers are loaded when the project is opened, and reloaded (by id, to follow renames) if they were changed outside this session
+            try:
+                if current_proj is None or current_proj["name"] != st.session_state.active_project:
+                    current_proj = store.load_project(st.session_state.active_project)
+                else:
+                    current_proj = store.load_project(project_id=current_proj["id"])
+                    if current_proj["name"] != st.session_state.active_project:
+                        st.session_state.conflict_notice = f"'{st.session_state.active_project}' was renamed to '{current_proj['name']}' in another session."
+                        st.session_state.active_project = current_proj["name"]
+                st.session_state.open_project = current_proj
+            except KeyError:
+                st.session_state.conflict_notice = f"'{st.session_state.active_project}' was deleted in another session."
+                st.session_state.active_project = None; st.rerun()
+        proj_settings = current_proj.setdefault("settings", {})
+
         uploaded_files = st.file_uploader("Upload academic papers (PDF)", type="pdf", accept_multiple_files=True)
+        opt_mode, opt_skip = st.columns([1, 1])
+        modes = list(ANALYSIS_MODES)
+        analysis_mode = opt_mode.selectbox("Analysis mode", modes, index=modes.index(proj_settings.get("analysis_mode", "truncate")), format_func=ANALYSIS_MODES.get)
+        if analysis_mode != proj_settings.get("analysis_mode", "truncate"):
+            # Merged with settings other sessions changed since this project was loaded
+            try:
+                current_proj["settings"] = proj_settings = store.set_settings(st.session_state.active_project, {**proj_settings, "analysis_mode": analysis_mode}, base=proj_settings)
+            except ConflictError as e:
+                st.session_state.conflict_notice = f"{e} Showing the saved value."
+                st.session_state.open_project = None; st.rerun()
+        skip_back_matter = opt_skip.checkbox("Skip references and appendices", value=False)
+        dedupe_all = opt_skip.checkbox("Check other projects for near-duplicates", value=False,
+                                       help="Papers whose text is very similar to one already stored (e.g. preprint and published version) are held back before any model call.")
         run_review = st.button("🔬 Analyse paper", use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
+        show_conflict_notice()
 
-        current_proj = st.session_state.projects[st.session_state.active_project]
-
-        if uploaded_files and llm and run_review:
-            progress_container = st.empty()
-            if 'session_uploads' not in st.session_state: st.session_state.session_uploads = set()
-            
-            for file in uploaded_files:
-                if file.name in st.session_state.session_uploads: continue
-                progress_container.text(f"📖 Critically reviewing: {file.name}...")
-                
-                try:
-                    reader = PdfReader(file)
-                    # Read full paper text but cap at 45k chars for API stability
-                    text = "".join([p.extract_text() for p in reader.pages if p.extract_text()]).strip()
-                    
-                    if not text:
-                        st.toast(f"⚠️ Could not extract text from {file.name}", icon="❌")
-                        continue
-
-                    # --- RESTORED PhD SUPERVISOR PROMPT ---
-                    prompt = (
-                        "Act as a Senior Academic Researcher and PhD Supervisor specializing in Systematic Literature Reviews. "
-                        "Evaluate the logic, methodology, and contribution to the field. Provide critical appraisal. "
-                        "Extract information for these categories precisely:\n\n"
-                        "[TITLE]: Full academic title.\n"
-                        "[AUTHORS]: Primary authors.\n"
-                        "[YEAR]: Publication year.\n"
-                        "[REFERENCE]: Full Harvard-style citation.\n"
-                        "[SUMMARY]: Core objective and outcome (2-3 sentences).\n"
-                        "[BACKGROUND]: Gap in literature and theoretical framework.\n"
-                        "[METHODOLOGY]: Design, sample size (N=), and instruments.\n"
-                        "[CONTEXT]: Location and population.\n"
-                        "[FINDINGS]: Results, statistical significance, and how it builds on previous work.\n"
-                        "[RELIABILITY]: Critique limitations, biases, and p-values.\n\n"
-                        "Rules: Output ONLY labels in brackets followed by analysis. No bold/bullets. "
-                        "Text: " + text[:45000]
-                    )
-                    
-                    res = llm.invoke([HumanMessage(content=prompt)]).content
-                    res = re.sub(r'\*', '', res) 
-                    
-                    def ext(label):
-                        p = rf"\[{label}\]\s*:?\s*(.*?)(?=\s*\[|$)"
-                        m = re.search(p, res, re.DOTALL | re.IGNORECASE)
-                        return m.group(1).strip() if m else "Not explicitly stated."
-
-                    new_paper = {
-                        "#": len(current_proj["papers"]) + 1,
-                        "Title": ext("TITLE"), "Authors": ext("AUTHORS"), "Year": ext("YEAR"), 
-                        "Reference": ext("REFERENCE"), "Summary": ext("SUMMARY"), 
-                        "Background": ext("BACKGROUND"), "Methodology": ext("METHODOLOGY"), 
-                        "Context": ext("CONTEXT"), "Findings": ext("FINDINGS"), 
-                        "Reliability": ext("RELIABILITY")
-                    }
-                    st.session_state.projects[st.session_state.active_project]["papers"].append(new_paper)
-                    st.session_state.projects[st.session_state.active_project]["last_accessed"] = time.time()
-                    st.session_state.session_uploads.add(file.name)
-                    save_data(st.session_state.projects)
-                except Exception as e:
-                    st.error(f"Error processing {file.name}: {e}")
-            
-            progress_container.empty()
+        if uploaded_files and run_review:
+            # Uploads are identified by content hash, so renamed copies are skipped and same-named papers don't collide
+            # A stored paper that is stale for this mode or model is re-analysed from the uploaded bytes instead
+            worker = get_job_worker()
+            files = [(f.name, f.getvalue()) for f in uploaded_files]
+            stored = {p["_source_hash"]: p for p in current_proj["papers"] if p.get("_source_hash")}
+            reuploaded = {stored[h]["_id"]: data for h, data in ((file_hash(data), data) for _, data in files)
+                          if h in stored and is_stale(stored[h], analysis_mode, MODEL_NAME)}
+            options = {"mode": analysis_mode, "skip_back_matter": skip_back_matter, "dedupe_all_projects": dedupe_all}
+            added = worker.queue.enqueue(current_proj["id"], files, options, skip_hashes=store.source_hashes(current_proj["id"]))
+            renewed = worker.queue.enqueue_reanalysis(current_proj["id"], [p for p in current_proj["papers"] if p["_id"] in reuploaded],
+                                                      {"mode": analysis_mode}, data=reuploaded)
+            worker.notify()
+            if added or renewed:
+                st.toast(f"Queued {len(added)} paper(s) for analysis" + (f" and {len(renewed)} for re-analysis" if renewed else ""), icon="⏳")
+            else:
+                st.toast("These papers are already in the project", icon="⏳")
             st.rerun()
 
-        papers_data = st.session_state.projects[st.session_state.active_project]["papers"]
+        active_jobs = get_job_worker().queue.active_count(current_proj["id"])
+        st.fragment(run_every=1 if active_jobs else None)(job_status_panel)(current_proj["id"], current_proj["revision"], bool(active_jobs))
+
+        papers_data = current_proj["papers"]
+        stale = [p for p in papers_data if is_stale(p, analysis_mode, MODEL_NAME)]
+        if stale:
+            with st.expander(f"♻️ {len(stale)} paper(s) were analysed with an older prompt or model"):
+                est = reanalysis_estimate(current_proj["id"], current_proj["revision"], analysis_mode, papers_data)
+                missing = len(stale) - len(est["paper_ids"])
+                if est["paper_ids"]:
+                    st.caption(f'{len(est["paper_ids"])} can be re-analysed from cached text: about {est["calls"]} model calls, '
+                               f'~{est["input_tokens"]:,} input / ~{est["output_tokens"]:,} output tokens, ~${est["cost_usd"]:.3f}.'
+                               + (f" {missing} need their PDF uploaded again." if missing else ""))
+                else:
+                    st.caption("Their full extracted text is not cached, so their PDFs need to be uploaded again to re-analyse them.")
+                if est["paper_ids"] and st.button(f'♻️ Re-analyse {len(est["paper_ids"])} paper(s)', key="reanalyse_stale"):
+                    # Runs on the background job queue: rate-limited, shown in the queue panel, resumed after a restart
+                    worker = get_job_worker()
+                    ids = set(est["paper_ids"])
+                    added = worker.queue.enqueue_reanalysis(current_proj["id"], [p for p in stale if p["_id"] in ids], {"mode": analysis_mode})
+                    worker.notify()
+                    st.toast(f"Queued {len(added)} paper(s) for re-analysis" if added else "These papers are already queued", icon="♻️")
+                    st.rerun()
         if papers_data:
             t1, t2, t3 = st.tabs(["🖼️ Individual Papers", "📊 Master Table", "🧠 Synthesis"])
             with t1:
-                for idx, r in enumerate(reversed(papers_data)):
-                    real_idx = len(papers_data) - 1 - idx
+                render_start = time.perf_counter()
+                c_search, c_size = st.columns([4, 1])
+                query = c_search.text_input("Search papers", placeholder="🔎 Filter by title, author or year", label_visibility="collapsed", key="papers_query").strip().lower()
+                page_size = c_size.selectbox("Papers per page", [10, 25, 50, 100], key="papers_page_size", label_visibility="collapsed")
+                # Newest first; only the current page is rendered, and card bodies only when opened
+                entries = list(enumerate(papers_data))[::-1]
+                if query:
+                    entries = [(i, r) for i, r in entries if query in f'{r.get("Title", "")} {r.get("Authors", "")} {r.get("Year", "")}'.lower()]
+                n_pages = max(1, -(-len(entries) // page_size))
+                page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1, key="papers_page") if n_pages > 1 else 1
+                visible = entries[(page - 1) * page_size:page * page_size]
+
+                for real_idx, r in visible:
+                    card_key = r.get("_id", real_idx)
                     with st.container(border=True):
                         st.subheader(r.get('Title', 'Untitled'))
                         st.markdown(f'🖊️ Authors: {r.get("Authors", "N/A")} | 🗓️ Year: {r.get("Year", "N/A")}')
-                        st.divider()
-                        sections = [("📝 Summary", "Summary"), ("📖 Background", "Background"), ("⚙️ Methodology", "Methodology"), ("📍 Context", "Context"), ("💡 Findings", "Findings"), ("🛡️ Reliability", "Reliability")]
-                        for label, key in sections:
-                            st.markdown(f'<span class="section-title">{label}</span><span class="section-content">{r.get(key, "")}</span>', unsafe_allow_html=True)
-                        
-                        if st.button("🗑️ Delete Paper", key=f"del_{real_idx}"):
-                            st.session_state.projects[st.session_state.active_project]["papers"].pop(real_idx)
-                            save_data(st.session_state.projects); st.rerun()
+                        if st.toggle("Show analysis", key=f"open_paper_{card_key}"):
+                            st.divider()
+                            for label, key in PAPER_SECTIONS:
+                                st.markdown(f'<span class="section-title">{label}</span><span class="section-content">{r.get(key, "")}</span>', unsafe_allow_html=True)
+
+                        if st.button("🗑️ Delete Paper", key=f"del_paper_{card_key}"):
+                            removed = papers_data.pop(real_idx)
+                            if not store.delete_paper(removed["_id"]):
+                                st.session_state.conflict_notice = f'"{removed.get("Title", "Untitled")}" had already been deleted in another session.'
+                            current_proj["revision"] += 1; st.rerun()
+
+                st.caption(f"Showing {len(visible)} of {len(entries)} matching papers ({len(papers_data)} total) · rendered in {(time.perf_counter() - render_start) * 1000:.0f} ms")
 
             with t2:
-                df = pd.DataFrame(papers_data)
-                st.dataframe(df, use_container_width=True, hide_index=True)
-                st.download_button("📊 Export CSV", df.to_csv(index=False).encode('utf-8-sig'), f"{st.session_state.active_project}.csv", use_container_width=True)
+                proj_id, revision = current_proj["id"], current_proj["revision"]
+                st.dataframe(project_table(proj_id, revision, papers_data), use_container_width=True, hide_index=True)
+                # Export bytes are only built when a button is clicked, then reused until the next revision
+                export_cols = st.columns(len(EXPORT_FORMATS))
+                for col, (fmt, (label, ext, mime, _)) in zip(export_cols, EXPORT_FORMATS.items()):
+                    col.download_button(label, lambda fmt=fmt: project_export(proj_id, revision, fmt, papers_data), f"{st.session_state.active_project}.{ext}", mime=mime, use_container_width=True)
 
             with t3:
-                # Meta-Synthesis Card
+                # Meta-Synthesis Card (cached on the project until its papers change)
                 with st.container(border=True):
-                    with st.spinner("Synthesizing..."):
-                        evidence = "".join([f"Paper {r.get('#')}: {r.get('Findings')}\n" for r in papers_data])
-                        synth_p = f"Act as PhD Supervisor. Synthesize these findings critically. Labels: [OVERVIEW], [PATTERNS], [CONTRADICTIONS], [FUTURE]. Evidence: {evidence}"
-                        raw_s = llm.invoke([HumanMessage(content=synth_p)]).content
-                        clean_s = re.sub(r'\*', '', raw_s)
-                        def gs(l, n=None):
-                            p = rf"\[{l}\]:?\s*(.*?)(?=\s*\[{n}\]|$)" if n else rf"\[{l}\]:?\s*(.*)"
-                            m = re.search(p, clean_s, re.DOTALL | re.IGNORECASE)
-                            return m.group(1).strip() if m else "Analysis pending."
-                        
-                        st.markdown("### 🎯 Executive Overview"); st.write(gs("OVERVIEW", "PATTERNS"))
-                        st.markdown("### 📈 Cross-Study Patterns"); st.write(gs("PATTERNS", "CONTRADICTIONS"))
-                        st.markdown("### ⚖️ Conflicts & Contradictions"); st.write(gs("CONTRADICTIONS", "FUTURE"))
-                        st.markdown("### 🚀 Future Research Directions"); st.write(gs("FUTURE"))
+                    synth_key = synthesis_key(papers_data)
+                    cached_s = current_proj.get("synthesis")
+                    c_regen, c_stop = st.columns([4, 1])
+                    regenerate = c_regen.button("🔄 Regenerate Synthesis", use_container_width=True)
+                    current = cached_s is not None and cached_s.get("key") == synth_key
+                    stopped = st.session_state.get("synthesis_stopped") == synth_key
+                    # Every paper a worker commits reruns the page, so synthesising then would pay for a root call per paper
+                    waiting = bool(active_jobs) and not current and not regenerate
+                    if waiting:
+                        st.info(f"{active_jobs} paper(s) are still being analysed; the synthesis will update when the queue finishes.", icon="⏳")
+                    elif stopped and not current and not regenerate:
+                        st.info("Synthesis stopped. Regenerate to run it again; finished groups of papers are reused.", icon="⏹️")
+                    slots = {}
+                    for label in SYNTH_SECTIONS:
+                        st.markdown(SYNTH_HEADINGS[label]); slots[label] = st.empty()
+                    if regenerate or (not current and not stopped and not waiting):
+                        st.session_state.pop("synthesis_stopped", None)
+                        # Clicking Stop reruns the script, which interrupts the stream below and closes it
+                        stop_slot = c_stop.empty()
+                        stop_slot.button("⏹️ Stop", use_container_width=True, on_click=lambda: st.session_state.update(synthesis_stopped=synth_key))
+                        parser = LabelStreamParser(SYNTH_SECTIONS)
+
+                        def show_partial(text):
+                            for label, value in parser.update(text).items():
+                                slots[label].write(value)
+
+                        with st.spinner("Synthesizing..."):
+                            # Partial syntheses are cached per group of papers, so only changed branches are re-sent
+                            with metric_labels(project_id=current_proj["id"], operation="synthesis"):
+                                raw_s = synthesize(llm, papers_data, cache=get_extraction_cache(), model=MODEL_NAME, force=regenerate,
+                                                   concurrency=int(st.secrets.get("LLM_CONCURRENCY", 4)), on_text=show_partial)
+                            stop_slot.empty()
+                            cached_s = {"key": synth_key, "raw": raw_s, "created": time.time()}
+                            current_proj["synthesis"] = cached_s
+                            # Only saved if no paper was added or removed while synthesising
+                            if not store.set_synthesis(st.session_state.active_project, cached_s, expected_revision=current_proj["revision"]):
+                                st.warning("Papers changed in another session while this synthesis ran, so it was not saved.", icon="⚠️")
+                    if cached_s:
+                        sections = parse_synthesis(cached_s["raw"])
+                        for label in SYNTH_SECTIONS:
+                            slots[label].write(sections[label])
 
         # Bottom Navigation
         st.markdown('<div class="bottom-actions">', unsafe_allow_html=True)
         col_s, col_l = st.columns([1, 1])
         with col_s:
             if st.button("💾 Save Project", use_container_width=True):
-                save_data(st.session_state.projects); st.toast("Saved!", icon="✅")
+                # Papers are written as they are added; saving just records the visit
+                store.touch_project(st.session_state.active_project); st.toast("Saved!", icon="✅")
         with col_l:
             if st.button("🏠 Library", use_container_width=True):
                 st.session_state.active_project = None; st.rerun()
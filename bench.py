@@ -0,0 +1,449 @@
+"""Offline benchmarks for the ingestion pipeline.
+
+    python bench.py extract --files 16 --pages 80 --workers 1 2 4
+    python bench.py analyse --files 8 --pages 120 --latency 0.5
+    python bench.py suite --sizes 10 100 1000 --latency 0.05
+    python bench.py search --papers 20000 --projects 50
+    python bench.py stress --sessions 16 --seconds 10
+    python bench.py ocr --files 2 --pages 12 --workers 1 2 4
+    python bench.py dedupe --papers 10000 --queries 100
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from metrics import RECORDER, percentile
+from minhash import NEAR_DUPLICATE_THRESHOLD, signature
+from ocr import OCRPool, OCR_AVAILABLE
+from pipeline import ExtractionPool, FakeLLM, PAPER_FIELDS, build_prompt, extract_text, file_hash, parse_paper, run_pipeline
+from store import ConflictError, ExtractionCache, ProjectStore
+from synthesis import synthesize
+
+# 1. SYNTHETIC INPUTS
+WORDS = ("study", "participants", "results", "significant", "model", "analysis", "sample", "effect",
+         "theory", "method", "data", "bias", "review", "evidence", "outcome", "framework")
+HEADINGS = ("Abstract", "1. Introduction", "2. Methods", "3. Results", "4. Discussion", "References")
+
+def synthetic_pdf(pages, lines_per_page=50, seed=0, headings=HEADINGS):
+    """A minimal text-only PDF (Helvetica, one content stream per page) with evenly spaced section headings."""
+    rng = random.Random(seed)
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    starts = {i * pages // len(headings): h for i, h in enumerate(headings)} if headings else {}
+    for page in range(pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        if page in starts:
+            lines.insert(0, starts[page])
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+def synthetic_scan(pages, seed=0, dpi=150):
+    """An image-only PDF, one greyscale JPEG of typeset words per page, as a scanner produces."""
+    from io import BytesIO
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size=dpi // 6)
+    images = []
+    for _ in range(pages):
+        image = Image.new("L", (int(8.5 * dpi), 11 * dpi), 255)
+        draw = ImageDraw.Draw(image)
+        for line in range(36):
+            draw.text((dpi // 2, dpi // 2 + line * dpi // 4), " ".join(rng.choice(WORDS) for _ in range(9)), fill=0, font=font)
+        images.append(image)
+    buf = BytesIO()
+    images[0].save(buf, "PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return buf.getvalue()
+
+def write_corpus(folder, files, pages):
+    paths = []
+    for i in range(files):
+        path = os.path.join(folder, f"synthetic_{i:03d}.pdf")
+        with open(path, "wb") as f:
+            f.write(synthetic_pdf(pages, seed=i))
+        paths.append(path)
+    return paths
+
+# 2. BENCHMARKS
+def bench_extraction(paths, worker_counts, budget=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    blobs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            blobs.append(f.read())
+    rows = []
+
+    t0 = time.perf_counter()
+    for data in blobs:
+        extract_text(data, budget=budget)
+    rows.append(("in-process", time.perf_counter() - t0))
+
+    for workers in worker_counts:
+        pool = ExtractionPool(workers=workers)
+        try:
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as threads:
+                list(threads.map(lambda d: pool.extract(d, budget=budget), blobs))
+            rows.append((f"{workers} worker(s)", time.perf_counter() - t0))
+        finally:
+            pool.close()
+
+    print(f"{len(blobs)} files, budget={budget or 'full'}")
+    for label, elapsed in rows:
+        print(f"  {label:<14} {elapsed:7.2f}s  {len(blobs) / elapsed:6.2f} files/s")
+
+def bench_analysis(paths, latency, concurrency, token_budget):
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+    print(f"{len(files)} files, fake latency={latency}s, concurrency={concurrency}")
+    for mode in ("truncate", "chunked"):
+        llm = FakeLLM(latency=latency)
+        t0 = time.perf_counter()
+        states = [state for _, state, _ in run_pipeline(llm, files, concurrency=concurrency, mode=mode, token_budget=token_budget)]
+        elapsed = time.perf_counter() - t0
+        print(f"  {mode:<9} {elapsed:7.2f}s  {llm.calls:4d} calls  ~{llm.tokens:8d} tokens  "
+              f"{states.count('done')}/{len(files)} done")
+
+def synthetic_paper(i, rng):
+    paper = {key: " ".join(rng.choice(WORDS) for _ in range(40)) for _, key in PAPER_FIELDS}
+    paper.update({"#": i + 1, "Title": f"Synthetic paper {i + 1}", "Authors": "Doe, J.", "Year": str(2000 + i % 25)})
+    return paper
+
+def rss_mb():
+    # Resident set size of this process (Linux); None where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def measure(fn, interval=0.005):
+    """Run fn() and return (result, wall seconds, peak RSS growth in MB or None).
+
+    RSS is sampled from a side thread rather than traced with tracemalloc,
+    which would slow pypdf down by an order of magnitude and skew wall times.
+    PDF worker processes are not included.
+    """
+    start = rss_mb()
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True) if start is not None else None
+    if sampler:
+        sampler.start()
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - t0
+        done.set()
+        if sampler:
+            sampler.join()
+    return result, elapsed, None if start is None else max(peak[0], rss_mb()) - start
+
+def bench_suite(sizes, pages, latency, concurrency, seed=0):
+    """Ingest, parse, persist and synthesise synthetic projects of each size end to end, headless."""
+    rows = []
+    for size in sizes:
+        rng = random.Random(seed)
+        with tempfile.TemporaryDirectory() as folder:
+            files = [(f"synthetic_{i:04d}.pdf", synthetic_pdf(pages, lines_per_page=30, seed=seed + i)) for i in range(size)]
+            llm = FakeLLM(latency=latency, seed=seed)
+
+            def stage(name, fn):
+                before = llm.calls
+                result, elapsed, peak = measure(fn)
+                rows.append((size, name, elapsed, peak, llm.calls - before))
+                return result
+
+            texts = stage("extract", lambda: [extract_text(data) for _, data in files])
+            prompts = stage("build prompts", lambda: [build_prompt(t) for t in texts])
+            responses = [json.dumps({label: f"Value {i}." for label, _ in PAPER_FIELDS}) for i in range(size)]
+            legacy = ["\n".join(f"[{label}]: Value {i}." for label, _ in PAPER_FIELDS) for i in range(size)]
+            stage("parse JSON", lambda: [parse_paper(r) for r in responses])
+            stage("parse labels", lambda: [parse_paper(r) for r in legacy])
+            stage("ingest (fake LLM)", lambda: [e for e in run_pipeline(llm, files, concurrency=concurrency)])
+
+            papers = [synthetic_paper(i, rng) for i in range(size)]
+            store = ProjectStore(os.path.join(folder, "projects.db"), legacy_json=None)
+            project_id = store.create_project("Synthetic")
+            stage("save papers", lambda: [store.add_paper_by_id(project_id, dict(p)) for p in papers])
+            stage("load project", lambda: store.load_project("Synthetic"))
+            stage("project index", store.project_index)
+            stage("load all", store.load_all)
+            with open(os.path.join(folder, "projects.json"), "w") as f:
+                blob = {"Synthetic": {"papers": papers, "last_accessed": 0}}
+                stage("save JSON (legacy)", lambda: json.dump(blob, f))
+            with open(os.path.join(folder, "projects.json")) as f:
+                stage("load JSON (legacy)", lambda: json.load(f))
+
+            cache = ExtractionCache(os.path.join(folder, "cache.db"))
+            stage("synthesis (cold)", lambda: synthesize(llm, papers, cache=cache, concurrency=concurrency))
+            papers.append(synthetic_paper(size, rng))
+            stage("synthesis (+1 paper)", lambda: synthesize(llm, papers, cache=cache, concurrency=concurrency))
+
+    print(f"pages/file={pages}, fake latency={latency}s, concurrency={concurrency}")
+    print(f"  {'papers':>6}  {'stage':<22} {'wall (s)':>9} {'peak MB':>8} {'LLM calls':>9}")
+    for size, name, elapsed, peak, calls in rows:
+        print(f"  {size:>6}  {name:<22} {elapsed:9.3f} {'–' if peak is None else f'{peak:.1f}':>8} {calls:9d}")
+    return rows
+
+def bench_search(papers, projects, vocabulary=20000, repeat=20):
+    """Index a library with a Zipf-distributed vocabulary and time queries of decreasing selectivity."""
+    rng = random.Random(0)
+    syllables = ("ka", "lo", "mi", "ne", "ru", "ta", "vi", "so", "pe", "da", "gu", "fo")
+    vocab = list(dict.fromkeys("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(vocabulary * 2)))[:vocabulary]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+    with tempfile.TemporaryDirectory() as folder:
+        store = ProjectStore(os.path.join(folder, "projects.db"), legacy_json=None)
+        ids = [store.create_project(f"Project {i}") for i in range(projects)]
+        t0 = time.perf_counter()
+        for i in range(papers):
+            paper = synthetic_paper(i, rng)
+            for _, key in PAPER_FIELDS[4:]:
+                paper[key] = " ".join(rng.choices(vocab, cum_weights=cum_weights, k=60))
+            store.add_paper_by_id(ids[i % projects], paper)
+        print(f"{papers} papers in {projects} projects indexed in {time.perf_counter() - t0:.1f}s (incremental, one insert each)")
+        queries = [vocab[1], vocab[50], vocab[2000], f"{vocab[10]} {vocab[300]}", f"synthetic paper {papers // 2}",
+                   "model"]  # "model" is in every paper: the worst case, every row is ranked
+        for query in queries:
+            timings = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                hits = store.search(query)
+                timings.append(time.perf_counter() - t0)
+            timings.sort()
+            print(f"  {query!r:<32} {len(hits):3d} hits  p50 {timings[len(timings) // 2] * 1000:6.1f} ms  "
+                  f"max {timings[-1] * 1000:6.1f} ms")
+
+def bench_dedupe(papers, queries, words=600, edit_rate=0.01, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Near-duplicate lookups against a growing signed library: latency, recall on edited copies, false positives."""
+    rng = random.Random(0)
+    vocab = [f"{rng.choice(WORDS)}{i}" for i in range(20000)]
+    texts = []
+    with tempfile.TemporaryDirectory() as folder:
+        store = ProjectStore(os.path.join(folder, "projects.db"), legacy_json=None)
+        pid = store.create_project("Library")
+        checkpoints = sorted({min(papers, n) for n in (papers // 100, papers // 10, papers)} - {0})
+        # Changing a share e of the words keeps about (1 - e) ** 5 of the 5-word shingles
+        kept = (1 - edit_rate) ** 5
+        print(f"edited copies change {edit_rate:.0%} of words: Jaccard ≈ {kept / (2 - kept):.2f}, threshold {threshold}")
+        for n in checkpoints:
+            t0 = time.perf_counter()
+            while len(texts) < n:
+                texts.append(" ".join(rng.choices(vocab, k=words)))
+                store.add_paper_by_id(pid, {"#": len(texts), "Title": f"Synthetic paper {len(texts)}", "_minhash": signature(texts[-1])})
+            print(f"{n} papers signed and indexed ({time.perf_counter() - t0:.1f}s)")
+            for kind in ("edited copy", "unrelated"):
+                timings, found = [], 0
+                for _ in range(queries):
+                    if kind == "edited copy":
+                        query = " ".join(w if rng.random() > edit_rate else rng.choice(vocab) for w in rng.choice(texts).split())
+                    else:
+                        query = " ".join(rng.choices(vocab, k=words))
+                    sig = signature(query)
+                    t0 = time.perf_counter()
+                    found += bool(store.near_duplicates(sig, threshold))
+                    timings.append(time.perf_counter() - t0)
+                print(f"  {kind:<12} flagged {found:4d}/{queries}  lookup p50 {percentile(timings, 0.5) * 1000:5.2f} ms  "
+                      f"p95 {percentile(timings, 0.95) * 1000:5.2f} ms")
+
+def stress_session(path, seed, seconds, project_ids):
+    """One simulated user hammering a shared database; returns per-project tallies of the writes that took effect."""
+    rng = random.Random(seed)
+    store = ProjectStore(path, legacy_json=None)
+    tally = {"ops": 0, "conflicts": 0, "errors": [], "adds": {}, "deletes": {}, "renames": {}}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pid = rng.choice(project_ids)
+        name = {p["id"]: n for n, p in store.project_index().items()}[pid]
+        op = rng.choice(("add", "add", "delete", "rename", "settings", "synthesis"))
+        try:
+            if op == "add":
+                paper = synthetic_paper(rng.randrange(10 ** 6), rng)
+                del paper["#"]  # numbered by the store, as background jobs do
+                store.add_paper_by_id(pid, paper)
+                tally["adds"][pid] = tally["adds"].get(pid, 0) + 1
+            elif op == "delete":
+                # The name may belong to another project by now, so tally on the id that was loaded
+                proj = store.load_project(name)
+                if proj["papers"] and store.delete_paper(rng.choice(proj["papers"])["_id"]):
+                    tally["deletes"][proj["id"]] = tally["deletes"].get(proj["id"], 0) + 1
+            elif op == "rename":
+                # A small pool of names so renames collide with each other
+                renamed = store.rename_project(name, f"Project {pid}" if rng.random() < 0.5 else f"Renamed {rng.randrange(len(project_ids) + 2)}")
+                tally["renames"][renamed] = tally["renames"].get(renamed, 0) + 1
+            elif op == "settings":
+                base = store.load_project(name)["settings"]
+                store.set_settings(name, {**base, rng.choice("abc"): rng.choice("xyz")}, base=base)
+            else:
+                revision = store.project_revision(pid)
+                store.set_synthesis(name, {"key": str(revision), "raw": "", "created": time.time()}, expected_revision=revision)
+        except (ConflictError, KeyError):
+            tally["conflicts"] += 1
+        except Exception as e:
+            tally["errors"].append(f"{op}: {type(e).__name__}: {e}")
+        tally["ops"] += 1
+    return tally
+
+def bench_stress(sessions, seconds, projects):
+    """Many concurrent sessions (separate processes) adding, deleting, renaming and editing the same projects."""
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "projects.db")
+        store = ProjectStore(path, legacy_json=None)
+        ids = [store.create_project(f"Project {i}") for i in range(projects)]
+        with ProcessPoolExecutor(max_workers=sessions, mp_context=multiprocessing.get_context("spawn")) as pool:
+            tallies = list(pool.map(stress_session, [path] * sessions, range(sessions), [seconds] * sessions, [ids] * sessions))
+
+        ops = sum(t["ops"] for t in tallies)
+        errors = [e for t in tallies for e in t["errors"]]
+        print(f"{sessions} sessions x {seconds}s on {projects} projects: {ops} ops ({ops / seconds:.0f}/s), "
+              f"{sum(t['conflicts'] for t in tallies)} rejected as conflicts, {len(errors)} errors")
+        for e in errors[:10]:
+            print("  ", e)
+
+        conn = store._conn()
+        problems = []
+        for pid in ids:
+            expected = sum(t["adds"].get(pid, 0) + t["deletes"].get(pid, 0) + t["renames"].get(pid, 0) for t in tallies)
+            revision, count = conn.execute("SELECT revision, paper_count FROM projects WHERE id = ?", (pid,)).fetchone()
+            numbers = [n for (n,) in conn.execute("SELECT json_extract(data, '$.\"#\"') FROM papers WHERE project_id = ?", (pid,))]
+            if revision != expected:
+                problems.append(f"project {pid}: revision {revision}, but {expected} writes took effect")
+            if count != len(numbers):
+                problems.append(f"project {pid}: paper_count {count}, but {len(numbers)} papers stored")
+            if len(set(numbers)) != len(numbers):
+                problems.append(f"project {pid}: duplicate paper numbers")
+        if store.search_enabled and conn.execute("SELECT COUNT(*) FROM paper_search").fetchone() != conn.execute("SELECT COUNT(*) FROM papers").fetchone():
+            problems.append("search index out of step with papers")
+        print("invariants:", "all hold" if not problems else "")
+        for p in problems:
+            print("  ", p)
+        return not problems and not errors
+
+class EventLog:
+    def __init__(self):
+        self.events = []
+
+    def record(self, event):
+        self.events.append(event)
+
+def bench_ocr(files, pages, worker_counts, budget=None):
+    """OCR throughput and per-page latency of scanned PDFs at several pool sizes, then a cached re-run."""
+    if not OCR_AVAILABLE:
+        print("OCR is not available: install the tesseract binary and the pytesseract package")
+        return False
+    blobs = [synthetic_scan(pages, seed=i) for i in range(files)]
+    first_pass = []  # what the extraction pool hands the OCR pool: page texts (None = blank) and page count
+    for data in blobs:
+        timings = {}
+        extract_text(data, budget=budget, timings=timings)
+        first_pass.append({"page_texts": timings.get("page_texts", []), "pages_total": timings["pages_total"]})
+    log = RECORDER.attach(EventLog())
+    print(f"{files} scanned files x {pages} pages, budget={budget or 'full'}")
+    for workers in worker_counts:
+        pool = OCRPool(workers=workers, page_budget=pages).start()
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ExtractionCache(os.path.join(folder, "cache.db"))
+            try:
+                rows = []
+                for run in ("cold", "cached"):
+                    del log.events[:]
+                    t0 = time.perf_counter()
+                    for data, layout in zip(blobs, first_pass):
+                        pool.extract(data, file_hash(data), budget=budget, cache=cache, **layout)
+                    rows.append((run, time.perf_counter() - t0, [e["duration_s"] for e in log.events if e["operation"] == "ocr"]))
+            finally:
+                pool.close()
+        for run, elapsed, page_s in rows:
+            line = f"  {workers} worker(s) {run:<7} {elapsed:7.2f}s  {len(page_s):4d} pages OCR'd"
+            if page_s:
+                line += (f"  {len(page_s) / elapsed:6.2f} pages/s  per page p50 {percentile(page_s, 0.5):.2f}s"
+                         f"  p95 {percentile(page_s, 0.95):.2f}s")
+            print(line)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("extract", help="PDF extraction throughput at several process-pool sizes")
+    p.add_argument("--files", type=int, default=16)
+    p.add_argument("--pages", type=int, default=80)
+    p.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    p.add_argument("--budget", type=int, default=None, help="character budget per file (default: whole document)")
+    p = sub.add_parser("analyse", help="truncated vs. chunked analysis against a fake LLM")
+    p.add_argument("--files", type=int, default=8)
+    p.add_argument("--pages", type=int, default=120)
+    p.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--token-budget", type=int, default=60000)
+    p = sub.add_parser("suite", help="extraction, parsing, persistence and synthesis at several project sizes")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    p.add_argument("--pages", type=int, default=4)
+    p.add_argument("--latency", type=float, default=0.05, help="seconds per fake LLM call")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("search", help="full-text search latency over a large synthetic library")
+    p.add_argument("--papers", type=int, default=20000)
+    p.add_argument("--projects", type=int, default=50)
+    p = sub.add_parser("stress", help="concurrent sessions writing to the same projects; checks store invariants")
+    p.add_argument("--sessions", type=int, default=16)
+    p.add_argument("--seconds", type=float, default=10)
+    p.add_argument("--projects", type=int, default=4)
+    p = sub.add_parser("ocr", help="OCR of scanned PDFs at several pool sizes (needs tesseract)")
+    p.add_argument("--files", type=int, default=2)
+    p.add_argument("--pages", type=int, default=12)
+    p.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    p.add_argument("--budget", type=int, default=None)
+    p = sub.add_parser("dedupe", help="MinHash/LSH near-duplicate lookup latency and accuracy as the library grows")
+    p.add_argument("--papers", type=int, default=10000)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        with tempfile.TemporaryDirectory() as folder:
+            bench_extraction(write_corpus(folder, args.files, args.pages), args.workers, budget=args.budget)
+    elif args.command == "analyse":
+        with tempfile.TemporaryDirectory() as folder:
+            bench_analysis(write_corpus(folder, args.files, args.pages), args.latency, args.concurrency, args.token_budget)
+    elif args.command == "suite":
+        bench_suite(args.sizes, args.pages, args.latency, args.concurrency, seed=args.seed)
+    elif args.command == "search":
+        bench_search(args.papers, args.projects)
+    elif args.command == "stress":
+        raise SystemExit(0 if bench_stress(args.sessions, args.seconds, args.projects) else 1)
+    elif args.command == "dedupe":
+        bench_dedupe(args.papers, args.queries, threshold=args.threshold)
+    elif args.command == "ocr":
+        raise SystemExit(0 if bench_ocr(args.files, args.pages, args.workers, args.budget) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import io
+import re
+
+import pandas as pd
+
+# 1. TABLE
+def papers_frame(papers):
+    # Internal bookkeeping keys ("_id", "_source_hash", ...) are not part of the table
+    df = pd.DataFrame(papers)
+    return df[[c for c in df.columns if not c.startswith("_")]]
+
+# 2. EXPORT FORMATS
+def to_csv(df):
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+def to_xlsx(df):
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Papers")
+    return buf.getvalue()
+
+def to_parquet(df):
+    buf = io.BytesIO()
+    df.astype(str).to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def _bib_escape(value):
+    return str(value).replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}")
+
+def to_bibtex(df):
+    entries, used = [], set()
+    for _, r in df.iterrows():
+        surname = re.findall(r"[A-Za-z]+", str(r.get("Authors", "")))
+        year = re.findall(r"\d{4}", str(r.get("Year", "")))
+        key = f"{surname[0].lower() if surname else 'paper'}{year[0] if year else ''}"
+        base, n = key, 1
+        while key in used:
+            n += 1
+            key = f"{base}_{n}"
+        used.add(key)
+        authors = re.sub(r"\s*(?:&|;)\s*", " and ", str(r.get("Authors", "")))
+        fields = [("title", r.get("Title", "")), ("author", authors), ("year", year[0] if year else r.get("Year", "")),
+                  ("note", r.get("Reference", ""))]
+        body = ",\n".join(f"  {name} = {{{_bib_escape(value)}}}" for name, value in fields if pd.notna(value) and value)
+        entries.append(f"@misc{{{key},\n{body}\n}}")
+    return ("\n\n".join(entries) + "\n").encode("utf-8")
+
+# label, file extension, MIME type, builder
+EXPORT_FORMATS = {
+    "csv": ("📊 Export CSV", "csv", "text/csv", to_csv),
+    "xlsx": ("📗 Export XLSX", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", to_xlsx),
+    "parquet": ("🧱 Export Parquet", "parquet", "application/octet-stream", to_parquet),
+    "bib": ("📚 Export BibTeX", "bib", "application/x-bibtex", to_bibtex),
+}
+
+try:
+    import openpyxl  # pandas' XLSX writer
+except ImportError:
+    del EXPORT_FORMATS["xlsx"]
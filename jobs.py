@@ -0,0 +1,334 @@
+import json
+import threading
+import time
+
+from metrics import metric_labels
+from minhash import NEAR_DUPLICATE_THRESHOLD, signature, similarity
+from pipeline import analyse_document, cached_source_text, file_hash, Cancelled, ExtractionError, ExtractionTimeout, MAX_PROMPT_CHARS
+from store import SQLiteRepository, DB_FILE
+
+# 1. SCHEMA
+# Lives in the project database so jobs are removed with their project
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    data BLOB,
+    options TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    note TEXT,
+    timings TEXT,
+    partial TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs(state, run_after, id);
+CREATE INDEX IF NOT EXISTS jobs_by_project ON jobs(project_id, id);
+"""
+
+JOB_STATES = ("queued", "extracting", "analysing", "done", "failed", "cancelled", "near-duplicate")
+ACTIVE_STATES = ("queued", "extracting", "analysing")
+MAX_ATTEMPTS = 3
+PARTIAL_FLUSH_S = 0.5  # how often a streaming job writes its response so far
+
+def retry_delay(attempts):
+    return min(300, 5 * 2 ** attempts)
+
+# 2. QUEUE
+class JobQueue(SQLiteRepository):
+    """Persistent ingestion queue. Uploaded PDF bytes are kept until their job succeeds."""
+    schema = JOB_SCHEMA
+
+    def __init__(self, path=DB_FILE):
+        super().__init__(path)
+        with self._conn() as conn:
+            if "partial" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN partial TEXT")
+
+    def enqueue(self, project_id, files, options=None, skip_hashes=()):
+        """Queue (name, pdf_bytes) pairs; files already queued, running or in skip_hashes are ignored."""
+        now = time.time()
+        with self._conn() as conn:
+            seen = set(skip_hashes) | {h for (h,) in conn.execute(
+                "SELECT digest FROM jobs WHERE project_id = ? AND state IN ('queued', 'extracting', 'analysing')", (project_id,))}
+            added = []
+            for name, data in files:
+                digest = file_hash(data)
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                cur = conn.execute(
+                    "INSERT INTO jobs (project_id, name, digest, data, options, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (project_id, name, digest, data, json.dumps(options or {}), now, now),
+                )
+                added.append(cur.lastrowid)
+        return added
+
+    def enqueue_reanalysis(self, project_id, papers, options=None, data=None):
+        """Queue stored papers to be analysed again; papers with a job in flight are skipped.
+
+        They run from cached text, or from the PDF bytes in `data` ({paper id: bytes}) for papers whose
+        PDF was uploaded again, which are re-extracted at the mode's budget.
+        """
+        now = time.time()
+        with self._conn() as conn:
+            busy = {p for (p,) in conn.execute(
+                "SELECT json_extract(options, '$.paper_id') FROM jobs WHERE project_id = ? AND state IN ('queued', 'extracting', 'analysing')",
+                (project_id,)) if p is not None}
+            added = []
+            for paper in papers:
+                if paper["_id"] in busy or not paper.get("_source_hash"):
+                    continue
+                profile = paper.get("_text_profile")
+                job_options = {**(options or {}), "paper_id": paper["_id"], "source_profile": profile,
+                               "skip_back_matter": bool(profile and profile.endswith("-nobackmatter"))}
+                cur = conn.execute(
+                    "INSERT INTO jobs (project_id, name, digest, data, options, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (project_id, f'♻️ {paper.get("Title") or "Untitled"}', paper["_source_hash"], (data or {}).get(paper["_id"]),
+                     json.dumps(job_options), now, now),
+                )
+                added.append(cur.lastrowid)
+        return added
+
+    def claim(self):
+        # Single UPDATE ... RETURNING so two workers can never claim the same job
+        with self._conn() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET state = 'extracting', attempts = attempts + 1, updated = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE state = 'queued' AND run_after <= ? ORDER BY id LIMIT 1) "
+                "RETURNING id, project_id, name, digest, data, options, attempts",
+                (time.time(), time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "project_id", "name", "digest", "data", "options", "attempts")
+        job = dict(zip(keys, row))
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def set_state(self, job_id, state):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND state != 'cancelled'", (state, time.time(), job_id))
+
+    def set_partial(self, job_id, text):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET partial = ? WHERE id = ? AND state = 'analysing'", (text, job_id))
+
+    def set_timings(self, job_id, timings):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET timings = ?, updated = ? WHERE id = ?", (json.dumps(timings), time.time(), job_id))
+
+    def complete(self, job_id, note=None):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = 'done', data = NULL, error = NULL, note = ?, partial = NULL, updated = ? "
+                         "WHERE id = ? AND state != 'cancelled'", (note, time.time(), job_id))
+
+    def is_cancelled(self, job_id):
+        row = self._conn().execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row[0] == "cancelled"
+
+    def fail(self, job_id, error, attempts, retryable=True):
+        """Requeue with backoff until MAX_ATTEMPTS, then park as failed (bytes kept for a manual retry)."""
+        now = time.time()
+        with self._conn() as conn:
+            if retryable and attempts < MAX_ATTEMPTS:
+                conn.execute("UPDATE jobs SET state = 'queued', error = ?, partial = NULL, run_after = ?, updated = ? "
+                             "WHERE id = ? AND state != 'cancelled'", (error, now + retry_delay(attempts), now, job_id))
+            else:
+                conn.execute("UPDATE jobs SET state = 'failed', error = ?, partial = NULL, updated = ? WHERE id = ? AND state != 'cancelled'",
+                             (error, now, job_id))
+
+    def hold_near_duplicate(self, job_id, note):
+        # Parked with its bytes, so the user can still have it analysed (retry with allow_near_duplicate)
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = 'near-duplicate', note = ?, partial = NULL, updated = ? WHERE id = ? AND state != 'cancelled'",
+                         (note, time.time(), job_id))
+
+    def cancel(self, job_id):
+        # A running job notices at its next streamed chunk (JobWorker.cancel); its bytes are kept for a retry
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = 'cancelled', partial = NULL, updated = ? "
+                         "WHERE id = ? AND state IN ('queued', 'extracting', 'analysing')", (time.time(), job_id))
+
+    def retry(self, job_id, **options):
+        # Uploads need their bytes; re-analysis jobs run from cached text. `options` are merged into the job's
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = 'queued', attempts = 0, run_after = 0, options = json_patch(options, ?), updated = ? "
+                         "WHERE id = ? AND state IN ('failed', 'cancelled', 'near-duplicate') "
+                         "AND (data IS NOT NULL OR json_extract(options, '$.paper_id') IS NOT NULL)",
+                         (json.dumps(options), time.time(), job_id))
+
+    def recover(self):
+        # Jobs that were mid-flight when the server stopped are picked up again
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET state = 'queued', run_after = 0 WHERE state IN ('extracting', 'analysing')")
+
+    def active_count(self, project_id):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE project_id = ? AND state IN ('queued', 'extracting', 'analysing')", (project_id,)).fetchone()[0]
+
+    def project_jobs(self, project_id, limit=100):
+        rows = self._conn().execute(
+            "SELECT id, name, state, attempts, error, note, timings, partial, created, updated FROM jobs "
+            "WHERE project_id = ? ORDER BY id DESC LIMIT ?", (project_id, limit))
+        keys = ("id", "name", "state", "attempts", "error", "note", "timings", "partial", "created", "updated")
+        jobs = [dict(zip(keys, r)) for r in rows]
+        for job in jobs:
+            job["timings"] = json.loads(job["timings"]) if job["timings"] else {}
+        return jobs
+
+    def clear_finished(self, project_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE project_id = ? AND state IN ('done', 'near-duplicate')", (project_id,))
+
+    def dismiss(self, job_id):
+        # Failed and cancelled jobs keep their PDF bytes for a retry until they are dismissed
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ? AND state IN ('failed', 'cancelled', 'near-duplicate')", (job_id,))
+
+# 3. WORKERS
+class JobWorker:
+    """Background threads that drain the JobQueue and commit finished papers to the ProjectStore.
+
+    They belong to the server process, not a script run, so work continues
+    when the user navigates away, reruns or closes the tab. Pass a FakeLLM to
+    run fully offline.
+    """
+
+    def __init__(self, llm, store, queue, workers=None, concurrency=4, poll_interval=1.0,
+                 near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD, **options):
+        self.llm = llm
+        self.store = store
+        self.queue = queue
+        # Threads default to the model-call cap, so `concurrency` papers can be analysed at once
+        self.workers = workers or concurrency
+        self.poll_interval = poll_interval
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.options = options  # cache, model, extractor, ... for analyse_document
+        self.llm_slots = threading.Semaphore(concurrency)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._cancelled = set()
+        self._in_flight = {}  # job id -> (project id, MinHash signature, name) of uploads being analysed
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.queue.recover()
+        threading.Thread(target=self.sign_stored_papers, name="job-signatures", daemon=True).start()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def cancel(self, job_id):
+        self.queue.cancel(job_id)
+        if job_id in self._running:
+            self._cancelled.add(job_id)
+
+    def sign_stored_papers(self):
+        """Add MinHash signatures to papers stored before they were recorded, where their text is still cached."""
+        cache = self.options.get("cache")
+        if cache is None:
+            return
+        for paper_id, digest, profile in self.store.unsigned_papers():
+            text, _ = cached_source_text(cache, digest, MAX_PROMPT_CHARS, source_profile=profile)
+            sig = signature(text) if text else None
+            if sig:
+                self.store.set_signature(paper_id, sig)
+
+    def _near_duplicate_check(self, job, project_id):
+        # Stored papers via the LSH index, then the few uploads still being analysed (two copies in one batch)
+        def check(sig):
+            matches = self.store.near_duplicates(sig, self.near_duplicate_threshold, project_id=project_id)
+            if matches:
+                return matches[0]
+            with self._lock:
+                for other_project, other_sig, name in self._in_flight.values():
+                    score = similarity(sig, other_sig)
+                    if (project_id is None or other_project == project_id) and score >= self.near_duplicate_threshold:
+                        return {"paper_id": None, "project": None, "#": None, "Title": name, "similarity": score}
+                self._in_flight[job["id"]] = (job["project_id"], sig, job["name"])
+            return None
+        return check
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self.process(job)
+
+    def process(self, job):
+        last_flush = [0.0]
+
+        def emit(state, payload):
+            if state in ("extracting", "analysing"):
+                self.queue.set_state(job["id"], state)
+            elif state == "extracted":
+                self.queue.set_timings(job["id"], payload)
+            elif state == "partial" and time.monotonic() - last_flush[0] >= PARTIAL_FLUSH_S:
+                # Throttled: the status panel polls about once a second anyway
+                self.queue.set_partial(job["id"], payload)
+                last_flush[0] = time.monotonic()
+
+        cancelled = lambda: job["id"] in self._cancelled
+        self._running.add(job["id"])
+        options = {**self.options, **job["options"]}
+        paper_id = options.pop("paper_id", None)
+        all_projects = options.pop("dedupe_all_projects", False)
+        if paper_id is None and not options.pop("allow_near_duplicate", False):
+            options["near_duplicate"] = self._near_duplicate_check(job, None if all_projects else job["project_id"])
+        try:
+            if paper_id is None and job["digest"] in self.store.source_hashes(job["project_id"]):
+                self.queue.complete(job["id"], note="duplicate")
+                return
+            with metric_labels(project_id=job["project_id"], operation="analyse" if paper_id is None else "reanalyse"):
+                state, paper = analyse_document(self.llm, job["data"], job["digest"], emit, self.llm_slots,
+                                                cancelled=cancelled, **options)
+            # The queue row is checked too: a cancel that landed before this job was marked running never reached _cancelled
+            if cancelled() or self.queue.is_cancelled(job["id"]):
+                return
+            if state == "near-duplicate":
+                where = f'#{paper["#"]} ' if paper["#"] else "an upload in progress, "
+                where += f'in {paper["project"]} ' if all_projects and paper["project"] else ""
+                self.queue.hold_near_duplicate(job["id"], f'Near-duplicate of {where}“{paper["Title"]}” ({paper["similarity"]:.0%} similar)')
+                return
+            if state == "empty":
+                self.queue.fail(job["id"], "Could not extract text", job["attempts"], retryable=False)
+                return
+            if paper_id is None:
+                self.store.add_paper_by_id(job["project_id"], paper)
+            elif not self.store.replace_paper(paper_id, paper):
+                state = "paper deleted"
+            self.queue.complete(job["id"], note=state)
+        except Cancelled:
+            pass  # already marked cancelled by JobWorker.cancel
+        except ExtractionError as e:
+            # A malformed PDF fails the same way every time; only timeouts are worth another attempt
+            self.queue.fail(job["id"], str(e), job["attempts"], retryable=isinstance(e, ExtractionTimeout))
+        except Exception as e:
+            self.queue.fail(job["id"], f"{type(e).__name__}: {e}", job["attempts"])
+        finally:
+            with self._lock:
+                self._in_flight.pop(job["id"], None)
+            self._running.discard(job["id"])
+            self._cancelled.discard(job["id"])
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+
+from metrics import RECORDER
+
+# 1. SHARED CLIENTS
+class SharedLLM:
+    """Wraps one long-lived chat model client.
+
+    Every call, from any session or background worker, takes a slot from one
+    process-wide semaphore so the server as a whole stays under the API quota.
+    """
+
+    def __init__(self, client, model, slots):
+        self.client = client
+        self.model = model
+        self.slots = slots
+
+    def _record(self, latency, input_tokens=0, output_tokens=0, error=None, **fields):
+        # Persisted with the caller's project/operation labels when a metrics store is attached (see metrics.RECORDER)
+        RECORDER.record("llm", latency, model=self.model, input_tokens=input_tokens, output_tokens=output_tokens,
+                        error=error, **fields)
+
+    def invoke(self, messages, **kwargs):
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        with self.slots:
+            t0 = time.perf_counter()
+            try:
+                res = self.client.invoke(messages, **kwargs)
+            except Exception as e:
+                self._record(time.perf_counter() - t0, error=type(e).__name__, prompt_chars=prompt_chars)
+                raise
+            latency = time.perf_counter() - t0
+        usage = getattr(res, "usage_metadata", None) or {}
+        self._record(latency, usage.get("input_tokens", 0), usage.get("output_tokens", 0),
+                     prompt_chars=prompt_chars, response_chars=len(str(res.content)))
+        return res
+
+    def stream(self, messages, **kwargs):
+        # Holds its slot until the stream is exhausted or closed; one metrics row per streamed call
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        input_tokens = output_tokens = response_chars = 0
+        error = None
+        with self.slots:
+            t0 = time.perf_counter()
+            try:
+                for chunk in self.client.stream(messages, **kwargs):
+                    # Streamed usage arrives as per-chunk deltas
+                    usage = getattr(chunk, "usage_metadata", None) or {}
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                    response_chars += len(str(chunk.content))
+                    yield chunk
+            except GeneratorExit:
+                error = "Cancelled"
+                raise
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                self._record(time.perf_counter() - t0, input_tokens, output_tokens, error=error,
+                             prompt_chars=prompt_chars, response_chars=response_chars)
+
+_clients = {}
+_clients_lock = threading.Lock()
+_global_slots = None
+
+def _default_client(model, api_key, temperature):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, google_api_key=api_key, temperature=temperature)
+
+def get_llm(model, api_key, temperature=0.1, max_concurrency=8, client_factory=None):
+    """Return the process-wide client for (model, temperature, API key), creating it on first use.
+
+    Reusing one client keeps its HTTP connection pool (and keep-alive
+    connections to the API) warm across reruns and sessions. The global
+    concurrency limit is fixed by the first call.
+    """
+    global _global_slots
+    key = (model, temperature, hashlib.sha256(str(api_key).encode("utf-8")).hexdigest())
+    with _clients_lock:
+        if _global_slots is None:
+            _global_slots = threading.BoundedSemaphore(max_concurrency)
+        if key not in _clients:
+            client = (client_factory or _default_client)(model, api_key, temperature)
+            _clients[key] = SharedLLM(client, model, _global_slots)
+        return _clients[key]
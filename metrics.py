@@ -0,0 +1,225 @@
+"""Call instrumentation: every model call and PDF extraction is recorded to a local SQLite store.
+
+    python metrics.py --port 9464     # serve /metrics in Prometheus text format
+"""
+import argparse
+import contextvars
+import time
+from contextlib import contextmanager
+
+from store import SQLiteRepository, METRICS_FILE
+
+# 1. SCHEMA
+METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    operation TEXT,
+    project_id INTEGER,
+    model TEXT,
+    duration_s REAL NOT NULL,
+    prompt_chars INTEGER NOT NULL DEFAULT 0,
+    response_chars INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    retry INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS events_by_time ON events(kind, time);
+"""
+
+# kind "llm": one row per model request (each retry attempt is its own row, numbered by `retry`)
+# kind "pdf": one row per text extraction ("extract") or OCR'd page ("ocr"); response_chars is the length of the text
+EVENT_COLUMNS = ("time", "kind", "operation", "project_id", "model", "duration_s", "prompt_chars", "response_chars",
+                 "input_tokens", "output_tokens", "pages", "retry", "error")
+RETENTION_DAYS = 30
+
+# USD per million input / output tokens
+MODEL_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+
+# 2. RECORDING
+_labels = contextvars.ContextVar("metric_labels", default={})
+
+@contextmanager
+def metric_labels(**labels):
+    """Attach labels (project_id, operation, retry, ...) to every event recorded inside the block."""
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+def propagate(fn):
+    # ThreadPoolExecutor does not copy context variables, so pool tasks are wrapped with the submitter's labels
+    labels = _labels.get()
+
+    def run(*args, **kwargs):
+        with metric_labels(**labels):
+            return fn(*args, **kwargs)
+    return run
+
+class MetricsRecorder:
+    """Fans events out to the attached stores. With none attached (CLI, benchmarks) recording is a no-op."""
+
+    def __init__(self):
+        self.sinks = []
+
+    def attach(self, sink):
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+        return sink
+
+    def record(self, kind, duration, **fields):
+        if not self.sinks:
+            return
+        event = {"time": time.time(), "kind": kind, "duration_s": duration, **_labels.get(), **fields}
+        for sink in self.sinks:
+            try:
+                sink.record(event)
+            except Exception:
+                pass  # Instrumentation must never fail the call it measures
+
+RECORDER = MetricsRecorder()
+
+class MetricsStore(SQLiteRepository):
+    schema = METRICS_SCHEMA
+
+    def __init__(self, path=METRICS_FILE, retention_days=RETENTION_DAYS):
+        super().__init__(path)
+        with self._conn() as conn:
+            conn.execute("DELETE FROM events WHERE time < ?", (time.time() - retention_days * 86400,))
+
+    def record(self, event):
+        values = [event.get(c) for c in EVENT_COLUMNS]
+        columns = [c for c, v in zip(EVENT_COLUMNS, values) if v is not None]
+        with self._conn() as conn:
+            conn.execute(f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                         [v for v in values if v is not None])
+
+    def events(self, since=0, kind=None):
+        sql = f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE time >= ?"
+        params = [since]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        return [dict(zip(EVENT_COLUMNS, row)) for row in self._conn().execute(sql + " ORDER BY time", params)]
+
+# 3. AGGREGATES
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def call_cost(event):
+    price_in, price_out = MODEL_PRICES.get(event.get("model"), (0.0, 0.0))
+    return (event["input_tokens"] * price_in + event["output_tokens"] * price_out) / 1e6
+
+def summarise(events, key="operation"):
+    """Per-`key` call counts, errors, retries, p50/p95 latency of successful calls, tokens and cost."""
+    groups = {}
+    for e in events:
+        groups.setdefault(e.get(key) or "", []).append(e)
+    rows = []
+    for name, group in sorted(groups.items(), key=lambda kv: str(kv[0])):
+        ok = [e["duration_s"] for e in group if not e["error"]]
+        rows.append({
+            key: name, "calls": len(group), "errors": len(group) - len(ok),
+            "retries": sum(e["retry"] > 0 for e in group),
+            "p50_s": percentile(ok, 0.5), "p95_s": percentile(ok, 0.95),
+            "input_tokens": sum(e["input_tokens"] for e in group), "output_tokens": sum(e["output_tokens"] for e in group),
+            "pages": sum(e["pages"] for e in group), "cost_usd": sum(call_cost(e) for e in group),
+        })
+    return rows
+
+# 4. PROMETHEUS EXPORT
+def _label_text(labels):
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+def _metric(lines, name, kind, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.extend(f"{name}{_label_text(labels)} {value}" for labels, value in samples)
+
+def _summary(lines, name, help_text, groups):
+    # groups: [(labels, events)]; quantiles over successful calls plus the _sum/_count pair
+    samples, totals = [], []
+    for labels, group in groups:
+        ok = [e["duration_s"] for e in group if not e["error"]]
+        samples += [({**labels, "quantile": q}, round(percentile(ok, float(q)), 6)) for q in ("0.5", "0.95") if ok]
+        totals += [(f"{name}_sum{_label_text(labels)}", round(sum(ok), 6)), (f"{name}_count{_label_text(labels)}", len(ok))]
+    _metric(lines, name, "summary", help_text, samples)
+    lines.extend(f"{series} {value}" for series, value in totals)
+
+def prometheus_text(events):
+    """Render events (normally the whole retention window) in the Prometheus text exposition format.
+
+    Counters cover the retention window, so they drop when old events are
+    pruned; Prometheus treats that as a counter reset.
+    """
+    lines = []
+    pdf = [e for e in events if e["kind"] == "pdf"]
+    by_llm = {}
+    for e in events:
+        if e["kind"] == "llm":
+            by_llm.setdefault((e["model"] or "", e["operation"] or ""), []).append(e)
+    groups = [({"model": m, "operation": op}, g) for (m, op), g in sorted(by_llm.items())]
+
+    _metric(lines, "buddy_llm_requests_total", "counter", "Model requests, including retry attempts.", [
+        ({**labels, "status": status}, sum((e["error"] is None) == (status == "ok") for e in g))
+        for labels, g in groups for status in ("ok", "error")])
+    _metric(lines, "buddy_llm_retries_total", "counter", "Model requests that were retry attempts.",
+            [(labels, sum(e["retry"] > 0 for e in g)) for labels, g in groups])
+    _metric(lines, "buddy_llm_tokens_total", "counter", "Tokens reported by the model.", [
+        ({**labels, "direction": d}, sum(e[f"{d}_tokens"] for e in g)) for labels, g in groups for d in ("input", "output")])
+    _metric(lines, "buddy_llm_chars_total", "counter", "Prompt and response characters.", [
+        ({**labels, "direction": d}, sum(e[f"{d}_chars"] for e in g)) for labels, g in groups for d in ("prompt", "response")])
+    _summary(lines, "buddy_llm_request_seconds", "Latency of successful model requests.", groups)
+    costs = {}
+    for g in by_llm.values():
+        for e in g:
+            costs[e["project_id"]] = costs.get(e["project_id"], 0.0) + call_cost(e)
+    _metric(lines, "buddy_llm_cost_usd_total", "counter", "Estimated model cost by project.", [
+        ({"project_id": "" if p is None else p}, round(c, 6)) for p, c in sorted(costs.items(), key=lambda kv: str(kv[0]))])
+
+    # operation "extract" is one row per document, "ocr" one row per OCR'd page
+    by_pdf = {}
+    for e in pdf:
+        by_pdf.setdefault(e["operation"] or "", []).append(e)
+    pdf_groups = [({"operation": op}, g) for op, g in sorted(by_pdf.items())]
+    _metric(lines, "buddy_pdf_extractions_total", "counter", "PDF text extractions and OCR'd pages.", [
+        ({**labels, "status": status}, sum((e["error"] is None) == (status == "ok") for e in g))
+        for labels, g in pdf_groups for status in ("ok", "error")])
+    _metric(lines, "buddy_pdf_pages_total", "counter", "PDF pages read.", [(labels, sum(e["pages"] for e in g)) for labels, g in pdf_groups])
+    _summary(lines, "buddy_pdf_extract_seconds", "Duration of successful PDF extractions and OCR'd pages.", pdf_groups)
+    return "\n".join(lines) + "\n"
+
+def serve(store, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(store.events()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    ThreadingHTTPServer(("", port), Handler).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=METRICS_FILE)
+    parser.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args()
+    serve(MetricsStore(args.db), args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""MinHash signatures of extracted paper text, for near-duplicate detection.
+
+The share of equal values in two signatures estimates the Jaccard similarity
+of the texts' word 5-shingles. Signatures are split into LSH bands that the
+project store indexes, so finding a paper's near-duplicates costs a fixed
+number of index lookups instead of a comparison with every stored paper.
+"""
+import re
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERM // LSH_BANDS  # 32 bands of 4: pairs above ~0.5 similarity share a band with high probability
+SHINGLE_WORDS = 5
+SIGNATURE_CHARS = 45000  # only the start of the text is signed, so truncated and full extractions compare alike
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_PRIME = (1 << 61) - 1
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(20240611)  # fixed: stored signatures must stay comparable across releases
+_A = _rng.randint(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+def shingles(text, k=SHINGLE_WORDS):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))} if words else set()
+
+def signature(text):
+    """Hex MinHash signature (NUM_PERM 32-bit values) of `text`, or None if it has no words."""
+    grams = shingles(text[:SIGNATURE_CHARS])
+    if not grams:
+        return None
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # a * h + b stays below 2**64 because a, b and h are all 32-bit
+    values = (((hashes[:, None] * _A + _B) % np.uint64(_PRIME)) & _MASK).min(axis=0)
+    return values.astype(">u4").tobytes().hex()
+
+def bands(sig):
+    """[(band, bucket)] keys under which a signature is indexed; see store.LSH_SCHEMA."""
+    width = LSH_ROWS * 8
+    return [(b, sig[b * width:(b + 1) * width]) for b in range(LSH_BANDS)]
+
+def similarity(sig_a, sig_b):
+    # Estimated Jaccard similarity: the share of equal 32-bit values
+    return sum(sig_a[i:i + 8] == sig_b[i:i + 8] for i in range(0, NUM_PERM * 8, 8)) / NUM_PERM
@@ -0,0 +1,177 @@
+"""OCR fallback for scanned PDFs: pages without a text layer are read with Tesseract in worker processes.
+
+Needs the optional `pytesseract` package and the `tesseract` binary. Without
+them OCR_AVAILABLE is False and scanned PDFs fail with a message saying so.
+Pages are OCR'd from the scan images embedded in them, so no PDF renderer is
+required.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from pypdf import PdfReader
+
+from metrics import RECORDER, percentile
+from pipeline import MAX_PROMPT_CHARS, ExtractionError, collect_text
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+OCR_AVAILABLE = bool(pytesseract and shutil.which(pytesseract.pytesseract.tesseract_cmd))
+OCR_PAGE_BUDGET = 30  # pages OCR'd per document; the text budget usually stops it sooner
+OCR_PAGE_TIMEOUT = 60
+MIN_IMAGE_PIXELS = 300 * 300  # logos and rules are not worth a Tesseract run
+
+# 1. WORKER PROCESSES
+_open_pdf = (None, None)  # (path, PdfReader) of the document this process is OCR'ing, so each page doesn't re-read it
+
+def ocr_page(path, index, lang="eng", timeout=OCR_PAGE_TIMEOUT):
+    """OCR page `index` of the PDF at `path` from its embedded scan images. Returns (text, seconds); runs in a pool process.
+
+    The file is read once per process and document, and the page is parsed and
+    its images decoded here, not in the server process. A page that turns out
+    to have a text layer returns that text with seconds None.
+    """
+    global _open_pdf
+    from PIL import Image
+
+    t0 = time.perf_counter()
+    if _open_pdf[0] != path:
+        _open_pdf = (path, PdfReader(path))  # pypdf reads the whole file, so it may be deleted once open
+    page = _open_pdf[1].pages[index]
+    text = page.extract_text()
+    if text:
+        return text, None
+    parts = []
+    for image_data in page_images(page):
+        try:
+            image = Image.open(BytesIO(image_data))
+            if image.width * image.height >= MIN_IMAGE_PIXELS:
+                parts.append(pytesseract.image_to_string(image.convert("L"), lang=lang, timeout=timeout))
+        except Exception:
+            pass  # undecodable image or Tesseract timeout: that image is skipped rather than failing the paper
+    return "\n".join(p.strip() for p in parts if p.strip()), time.perf_counter() - t0
+
+def page_images(page):
+    try:
+        return [image.data for image in page.images]
+    except Exception:
+        return []  # image filters pypdf cannot decode
+
+class OCRPool:
+    """Long-lived Tesseract worker processes shared by every session; pages of one PDF are OCR'd in parallel.
+
+    The pool starts on first use, so servers that never see a scan never spawn it.
+    """
+
+    def __init__(self, workers=None, page_budget=OCR_PAGE_BUDGET, lang="eng", timeout=OCR_PAGE_TIMEOUT):
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.page_budget = page_budget
+        self.lang = lang
+        self.timeout = timeout
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def start(self):
+        # Spawn every worker now rather than on the first scan (each process takes about a second to import)
+        list(self._executor().map(time.sleep, [0.2] * self.workers))
+        return self
+
+    def extract(self, data, digest=None, page_texts=(), pages_total=None, budget=MAX_PROMPT_CHARS, skip_back_matter=False,
+                cache=None):
+        """Text of a scanned PDF: text-layer pages as-is, image-only pages OCR'd. Returns (text, timings).
+
+        `page_texts` and `pages_total` come from the first extraction pass (see
+        pipeline.extract_text): pages with text are taken from it, and only the
+        others are sent to the pool. The PDF is written once to a temporary
+        file that every worker reads, rather than sent with each page. OCR'd pages
+        are cached by file hash and page, so a document is never OCR'd twice
+        whatever budget it is extracted with later.
+        """
+        if not OCR_AVAILABLE:
+            raise ExtractionError("This PDF has no text layer and OCR is not available (install tesseract and pytesseract)")
+        t0 = time.perf_counter()
+        cached = cache.get_ocr_pages(digest) if cache and digest else {}
+        pages = iter(range(len(page_texts) if pages_total is None else pages_total))
+        ahead = deque()  # (page, text or pending OCR future) in page order
+        futures, seconds, counts = [], {}, {"resolved": 0, "cached": 0}
+        spilled = []  # the temporary copy of the PDF, written when the first page needs OCR
+        lookahead = 2 * self.workers
+
+        def scan_ahead():
+            # Queue pages until every worker has work waiting, so OCR overlaps with collecting earlier pages
+            while (len(futures) - counts["resolved"] < lookahead and len(ahead) < 4 * lookahead
+                   and len(futures) < self.page_budget):
+                i = next(pages, None)
+                if i is None:
+                    return
+                text = page_texts[i] if i < len(page_texts) else None
+                if text is None and i in cached:
+                    text = cached[i]
+                    counts["cached"] += 1
+                if text is None:
+                    if not spilled:
+                        spilled.append(self._spill(data))
+                    text = self._executor().submit(ocr_page, spilled[0], i, self.lang, self.timeout)
+                    futures.append(text)
+                ahead.append((i, text))
+
+        def page_texts_in_order():
+            # Stops being consumed once collect_text has its budget; pages still queued are cancelled
+            scan_ahead()
+            while ahead:
+                i, text = ahead.popleft()
+                if isinstance(text, Future):
+                    text, page_s = text.result()
+                    counts["resolved"] += 1
+                    if page_s is not None:  # None: a text-layer page past where the first pass stopped
+                        seconds[i] = page_s
+                        RECORDER.record("pdf", page_s, operation="ocr", pages=1, response_chars=len(text))
+                        if cache and digest:
+                            cache.put_ocr_page(digest, i, text, page_s)
+                scan_ahead()
+                if text:
+                    yield text
+
+        try:
+            text, pages_read, stopped_at = collect_text(page_texts_in_order(), budget, skip_back_matter)
+        except BrokenProcessPool:
+            self._pool = None
+            raise ExtractionError("OCR worker crashed")
+        finally:
+            for future in futures:
+                future.cancel()
+            for path in spilled:
+                os.remove(path)
+        timings = {
+            "ocr_s": time.perf_counter() - t0, "ocr_pages": len(seconds), "ocr_cached_pages": counts["cached"],
+            "ocr_page_p50_s": percentile(list(seconds.values()), 0.5), "ocr_page_max_s": max(seconds.values(), default=None),
+            "pages_read": pages_read, "chars": len(text), "stopped_at": stopped_at,
+        }
+        return text, timings
+
+    @staticmethod
+    def _spill(data):
+        # Never reused, even after deletion, so a worker's open document can't be mistaken for a later one
+        fd, path = tempfile.mkstemp(prefix=f"ocr-{uuid.uuid4().hex}-", suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return path
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
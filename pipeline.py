@@ -0,0 +1,756 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+try:
+    import resource
+except ImportError:  # Windows: no memory caps for worker processes
+    resource = None
+
+from pypdf import PdfReader
+from langchain_core.messages import HumanMessage
+
+from metrics import RECORDER, metric_labels, propagate
+from minhash import signature
+
+# 1. PAPER ANALYSIS
+MAX_PROMPT_CHARS = 45000
+ANALYSIS_PROMPT_VERSION = 2
+PAPER_FIELDS = [
+    ("TITLE", "Title"), ("AUTHORS", "Authors"), ("YEAR", "Year"),
+    ("REFERENCE", "Reference"), ("SUMMARY", "Summary"), ("BACKGROUND", "Background"),
+    ("METHODOLOGY", "Methodology"), ("CONTEXT", "Context"), ("FINDINGS", "Findings"),
+    ("RELIABILITY", "Reliability"),
+]
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Headings that start the back matter; only honoured once some body text has been read (not in a TOC)
+BACK_MATTER_HEADING = re.compile(r"^\s*(?:\d+\.?\s*)?(references|bibliography|works cited|appendix|appendices)\s*$", re.IGNORECASE | re.MULTILINE)
+MIN_BODY_CHARS = 2000
+
+def iter_page_text(reader, pages=None):
+    # Each page is extracted exactly once; every page read is also appended to `pages` (None: no text layer, a scan)
+    for page in reader.pages:
+        text = page.extract_text()
+        if pages is not None:
+            pages.append(text or None)
+        if text:
+            yield text
+
+def collect_text(page_texts, budget=MAX_PROMPT_CHARS, skip_back_matter=False):
+    """Join page texts in order until `budget` characters (None = all) or, optionally, the back matter.
+
+    Returns (text, pages_read, stopped_at).
+    """
+    parts, total, pages_read, stopped_at = [], 0, 0, "end"
+    for text in page_texts:
+        pages_read += 1
+        if skip_back_matter and total >= MIN_BODY_CHARS:
+            m = BACK_MATTER_HEADING.search(text)
+            if m:
+                parts.append(text[:m.start()])
+                stopped_at = m.group(1).lower()
+                break
+        parts.append(text)
+        total += len(text)
+        if budget and total >= budget:
+            stopped_at = "budget"
+            break
+    text = "".join(parts).strip()
+    return (text[:budget] if budget else text), pages_read, stopped_at
+
+def extract_text(data, budget=MAX_PROMPT_CHARS, skip_back_matter=False, timings=None):
+    """Extract page text until `budget` characters are collected (None = whole document).
+
+    Pass a dict as `timings` to receive a per-document breakdown. For a scan
+    (see needs_ocr) it also gets "page_texts", the text of each page read with
+    None for pages without a text layer, for the OCR pool.
+    """
+    t0 = time.perf_counter()
+    reader = PdfReader(BytesIO(data))
+    t1 = time.perf_counter()
+    pages = []
+    text, pages_read, stopped_at = collect_text(iter_page_text(reader, pages), budget, skip_back_matter)
+    if timings is not None:
+        timings.update({
+            "open_s": t1 - t0, "extract_s": time.perf_counter() - t1,
+            "pages_read": pages_read, "pages_total": len(reader.pages), "blank_pages": pages.count(None),
+            "chars": len(text), "stopped_at": stopped_at,
+        })
+        if needs_ocr(timings):
+            timings["page_texts"] = pages
+    return text
+
+def needs_ocr(timings):
+    # Most pages have no text layer: a scan, perhaps with a publisher's generated cover page
+    blank = timings.get("blank_pages", 0)
+    return blank > 0 and blank >= timings.get("pages_read", 0)
+
+def text_profile(budget=MAX_PROMPT_CHARS, skip_back_matter=False):
+    # Extraction cache variant: text cut at different budgets is not interchangeable
+    return f"{budget or 'full'}{'-nobackmatter' if skip_back_matter else ''}"
+
+# --- PhD SUPERVISOR PROMPT ---
+SUPERVISOR_PROMPT = (
+    "Act as a Senior Academic Researcher and PhD Supervisor specializing in Systematic Literature Reviews. "
+    "Evaluate the logic, methodology, and contribution to the field. Provide critical appraisal. "
+    "Extract information for these categories precisely:\n\n"
+    "[TITLE]: Full academic title.\n"
+    "[AUTHORS]: Primary authors.\n"
+    "[YEAR]: Publication year.\n"
+    "[REFERENCE]: Full Harvard-style citation.\n"
+    "[SUMMARY]: Core objective and outcome (2-3 sentences).\n"
+    "[BACKGROUND]: Gap in literature and theoretical framework.\n"
+    "[METHODOLOGY]: Design, sample size (N=), and instruments.\n"
+    "[CONTEXT]: Location and population.\n"
+    "[FINDINGS]: Results, statistical significance, and how it builds on previous work.\n"
+    "[RELIABILITY]: Critique limitations, biases, and p-values.\n\n"
+    "Rules: Respond with a single JSON object whose keys are these labels (without brackets) and whose "
+    "values are the analysis as plain text. No bold/bullets. "
+)
+
+def json_schema(labels):
+    return {
+        "type": "object",
+        "properties": {label: {"type": "string"} for label in labels},
+        "required": list(labels),
+    }
+
+PAPER_SCHEMA = json_schema([label for label, _ in PAPER_FIELDS])
+
+def build_prompt(text):
+    return SUPERVISOR_PROMPT + "Text: " + text[:MAX_PROMPT_CHARS]
+
+# Response parsing outcomes since process start: json, labels (legacy format), partial, failed
+PARSE_STATS = {"json": 0, "labels": 0, "partial": 0, "failed": 0}
+_parse_lock = threading.Lock()
+
+def _count(outcome):
+    with _parse_lock:
+        PARSE_STATS[outcome] += 1
+
+def _loads_tolerant(res):
+    # Accepts code fences and chatter around the object
+    start = res.find("{")
+    if start < 0:
+        return None
+    try:
+        data, _ = json.JSONDecoder().raw_decode(res[start:])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _split_labels(res, labels):
+    res = re.sub(r'\*', '', res)
+    marker = re.compile(r"\[(" + "|".join(map(re.escape, labels)) + r")\]\s*:?", re.IGNORECASE)
+    matches = list(marker.finditer(res))
+    found = {}
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        label = m.group(1).upper()
+        body = res[m.end():nxt.start() if nxt else len(res)].strip()
+        if body and label not in found:
+            found[label] = body
+    return found
+
+def parse_labelled(res, labels, default):
+    """Parse a response into {label: text} in one pass over the text.
+
+    Structured (JSON) responses are tried first; legacy "[LABEL]: ..." responses
+    are split only at the expected labels, so "[12]"-style citations survive.
+    """
+    data = _loads_tolerant(res)
+    if data is not None:
+        lookup = {str(k).strip(" []").upper(): v for k, v in data.items()}
+        found = {label: re.sub(r'\*', '', str(lookup[label])).strip() for label in labels if lookup.get(label)}
+        _count("json")
+    else:
+        found = _split_labels(res, labels)
+        _count("labels" if found else "failed")
+    if found and len(found) < len(labels):
+        _count("partial")
+    return {label: found.get(label) or default for label in labels}
+
+def parse_paper(res):
+    parsed = parse_labelled(res, [label for label, _ in PAPER_FIELDS], "Not explicitly stated.")
+    return {key: parsed[label] for label, key in PAPER_FIELDS}
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class LabelStreamParser:
+    """Incremental parse_labelled for a response that is still streaming in.
+
+    `update(text_so_far)` returns {label: text} for the labels seen so far, the
+    last one possibly cut mid-sentence. JSON replies are scanned one character
+    at a time and the scan resumes where the previous update stopped, so a
+    whole stream costs one pass; text that does not extend the previous one
+    (the call was retried) restarts the scan.
+    """
+
+    def __init__(self, labels):
+        self.labels = set(labels)
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.mode = None  # "json" or "labels", decided by the first non-blank character
+        self.values = {}
+        self._state, self._key, self._label, self._escape, self._high = "seek", [], None, None, None
+
+    def update(self, text):
+        if not text.startswith(self.text):
+            self.reset()
+        start, self.text = len(self.text), text
+        if self.mode is None and text.strip():
+            self.mode = "json" if text.lstrip()[0] in "{`" else "labels"
+        if self.mode == "labels":
+            return _split_labels(text, self.labels)
+        if self.mode == "json":
+            for ch in text[start:]:
+                self._step(ch)
+        return {label: re.sub(r'\*', '', "".join(v)).strip() for label, v in self.values.items() if v}
+
+    def _step(self, ch):
+        state = self._state
+        if state == "seek":  # before a key: braces, commas, whitespace, code fences
+            if ch == '"':
+                self._state, self._key = "key", []
+        elif state == "key":
+            if self._escape is not None:
+                self._key.append(ch)
+                self._escape = None
+            elif ch == "\\":
+                self._escape = ""
+            elif ch == '"':
+                self._state = "colon"
+            else:
+                self._key.append(ch)
+        elif state == "colon":
+            if ch == ":":
+                self._state = "value"
+        elif state == "value":
+            if ch == '"':
+                label = "".join(self._key).strip(" []").upper()
+                self._label = label if label in self.labels else None
+                if self._label:
+                    self.values.setdefault(self._label, [])
+                self._state = "string"
+            elif not ch.isspace():
+                self._state = "scalar"
+        elif state == "scalar":  # numbers, null, ...: not shown
+            if ch in ",}":
+                self._state = "seek"
+        elif self._escape is not None:
+            self._escape += ch
+            if self._escape[0] != "u":
+                self._emit(_JSON_ESCAPES.get(ch, ch))
+                self._escape = None
+            elif len(self._escape) == 5:
+                if all(c in "0123456789abcdefABCDEF" for c in self._escape[1:]):
+                    self._emit_code(int(self._escape[1:], 16))
+                self._escape = None
+        elif ch == "\\":
+            self._escape = ""
+        elif ch == '"':
+            self._state = "seek"
+        else:
+            self._emit(ch)
+
+    def _emit_code(self, code):
+        # \uXXXX escapes outside the BMP arrive as a surrogate pair
+        if 0xD800 <= code < 0xDC00:
+            self._high = code
+            return
+        if 0xDC00 <= code < 0xE000 and self._high is not None:
+            code = 0x10000 + ((self._high - 0xD800) << 10) + (code - 0xDC00)
+        self._high = None
+        self._emit(chr(code))
+
+    def _emit(self, ch):
+        if self._label:
+            self.values[self._label].append(ch)
+
+# 2. CHUNKED (MAP-REDUCE) ANALYSIS
+ANALYSIS_MODES = {"truncate": "Fast (first 45k characters)", "chunked": "Full paper (section chunks)"}
+CHARS_PER_TOKEN = 4
+CHUNK_CHARS = 12000
+CHUNK_TOKEN_BUDGET = 60000
+CHUNK_NOTES_RESERVE = 1500  # chars of map output per chunk that the reduce step will re-read
+
+SECTION_HEADING = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?\s+)?(abstract|introduction|background|literature review|related work|"
+    r"materials and methods|methods?|methodology|results|findings|discussion|conclusions?|limitations|"
+    r"references|bibliography|appendix|appendices|acknowledge?ments)\b[^\n]{0,40}$",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Lower is kept first when a paper does not fit its token budget
+SECTION_PRIORITY = {
+    "front": 0, "abstract": 0, "results": 0, "findings": 0, "discussion": 0, "conclusion": 0,
+    "conclusions": 0, "limitations": 0, "method": 1, "methods": 1, "methodology": 1,
+    "materials and methods": 1, "introduction": 2, "background": 2, "literature review": 2,
+    "related work": 2, "references": 9, "bibliography": 9, "appendix": 9, "appendices": 9,
+    "acknowledgements": 9, "acknowledgments": 9,
+}
+
+CHUNK_PROMPT = (
+    "You are reading one excerpt ({section}) of an academic paper. Note only what this excerpt states "
+    "for these labels, or 'None' if it says nothing relevant: [TITLE], [AUTHORS], [YEAR], [REFERENCE], "
+    "[SUMMARY], [BACKGROUND], [METHODOLOGY], [CONTEXT], [FINDINGS], [RELIABILITY]. "
+    "Be terse; keep numbers, sample sizes and p-values. Excerpt: "
+)
+
+def split_sections(text):
+    """Split text at recognised headings into (section, text) pairs, in document order."""
+    marks = [(m.start(), m.group(1).lower()) for m in SECTION_HEADING.finditer(text)]
+    if not marks or marks[0][0] > 0:
+        marks.insert(0, (0, "front"))
+    ends = [start for start, _ in marks[1:]] + [len(text)]
+    return [(name, text[start:end]) for (start, name), end in zip(marks, ends) if text[start:end].strip()]
+
+def chunk_sections(sections, chunk_chars=CHUNK_CHARS):
+    chunks = []
+    for name, body in sections:
+        while body:
+            cut = len(body) if len(body) <= chunk_chars else body.rfind(" ", 0, chunk_chars) + 1 or chunk_chars
+            chunks.append((name, body[:cut]))
+            body = body[cut:]
+    return chunks
+
+def select_chunks(chunks, token_budget=CHUNK_TOKEN_BUDGET):
+    """Keep the highest-priority chunks that fit the budget, returned in document order."""
+    budget = token_budget * CHARS_PER_TOKEN - len(SUPERVISOR_PROMPT)
+    ranked = sorted(range(len(chunks)), key=lambda i: (SECTION_PRIORITY.get(chunks[i][0], 1), i))
+    keep = []
+    for i in ranked:
+        cost = len(CHUNK_PROMPT) + len(chunks[i][1]) + CHUNK_NOTES_RESERVE
+        if cost > budget:
+            continue
+        keep.append(i)
+        budget -= cost
+    return [chunks[i] for i in sorted(keep)]
+
+def analyse_chunked(call, text, token_budget=CHUNK_TOKEN_BUDGET):
+    """Map a cheap extraction over section chunks in parallel, then reduce to the ten-field response.
+
+    `call(prompt, schema=None)` performs one (rate-limited) model call and returns its text.
+    """
+    chunks = select_chunks(chunk_sections(split_sections(text)), token_budget)
+    if len(chunks) <= 1:
+        return call(build_prompt(text), PAPER_SCHEMA)
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        notes = list(pool.map(propagate(lambda c: call(CHUNK_PROMPT.format(section=c[0]) + c[1])), chunks))
+    evidence = "\n\n".join(f"--- {section} ---\n{n}" for (section, _), n in zip(chunks, notes))
+    return call(SUPERVISOR_PROMPT + "Notes extracted from consecutive sections of the paper: " + evidence, PAPER_SCHEMA)
+
+def extraction_budget(mode, token_budget=CHUNK_TOKEN_BUDGET):
+    return token_budget * CHARS_PER_TOKEN if mode == "chunked" else MAX_PROMPT_CHARS
+
+def prompt_version(mode):
+    return str(ANALYSIS_PROMPT_VERSION) if mode == "truncate" else f"{ANALYSIS_PROMPT_VERSION}-{mode}"
+
+def provenance(digest, mode, model, profile):
+    # Stored with each paper so analyses from an older prompt or model can be found and re-run from cached text
+    return {"_source_hash": digest, "_prompt_version": prompt_version(mode), "_model": model, "_text_profile": profile}
+
+def is_stale(paper, mode, model):
+    return (paper.get("_prompt_version"), paper.get("_model")) != (prompt_version(mode), model)
+
+# Rough size of one ten-field analysis and of one chunk's notes, for cost estimates
+EST_PAPER_OUTPUT_TOKENS = 900
+EST_NOTES_OUTPUT_TOKENS = 350
+
+def estimate_analysis(text, mode="truncate", token_budget=CHUNK_TOKEN_BUDGET):
+    """Return (calls, input_tokens, output_tokens) that analysing `text` is expected to take."""
+    if mode == "chunked":
+        chunks = select_chunks(chunk_sections(split_sections(text)), token_budget)
+        if len(chunks) > 1:
+            notes_in = sum(len(CHUNK_PROMPT) + len(body) for _, body in chunks) // CHARS_PER_TOKEN
+            reduce_in = len(SUPERVISOR_PROMPT) // CHARS_PER_TOKEN + len(chunks) * EST_NOTES_OUTPUT_TOKENS
+            return len(chunks) + 1, notes_in + reduce_in, len(chunks) * EST_NOTES_OUTPUT_TOKENS + EST_PAPER_OUTPUT_TOKENS
+    return 1, len(build_prompt(text[:MAX_PROMPT_CHARS])) // CHARS_PER_TOKEN, EST_PAPER_OUTPUT_TOKENS
+
+# 3. PDF WORKER PROCESSES
+class ExtractionError(Exception):
+    pass
+
+class SourceTextMissing(ExtractionError):
+    """Re-analysis needs the cached extracted text, and it has been evicted or is too short for the mode."""
+
+class ExtractionTimeout(ExtractionError):
+    pass
+
+def _extraction_worker(conn, mem_limit):
+    if mem_limit and resource:
+        resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        data, kwargs = task
+        try:
+            timings = {}
+            text = extract_text(data, timings=timings, **kwargs)
+            conn.send(("ok", text, timings))
+        except MemoryError:
+            conn.send(("error", "PDF exceeded the worker memory cap", None))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", None))
+
+class ExtractionPool:
+    """Long-lived pypdf worker processes, keeping CPU-bound parsing off the Streamlit threads.
+
+    A worker that exceeds `timeout` seconds on one file (malformed PDFs can hang
+    pypdf) or dies is killed and replaced; the call raises ExtractionError.
+    """
+
+    def __init__(self, workers=None, timeout=120, mem_limit_mb=1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.mem_limit = mem_limit_mb * 1024 * 1024 if mem_limit_mb else None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(self._start_worker())
+
+    def _start_worker(self):
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_extraction_worker, args=(child, self.mem_limit), daemon=True)
+        proc.start()
+        child.close()
+        return proc, parent
+
+    def _replace(self, proc, conn):
+        proc.kill()
+        proc.join()
+        conn.close()
+        return self._start_worker()
+
+    def extract(self, data, **kwargs):
+        """Thread-safe; blocks until a worker is free. Returns (text, timings)."""
+        proc, conn = self._idle.get()
+        try:
+            conn.send((data, kwargs))
+            if not conn.poll(self.timeout):
+                proc, conn = self._replace(proc, conn)
+                raise ExtractionTimeout(f"PDF parsing timed out after {self.timeout}s")
+            status, text, timings = conn.recv()
+        except (EOFError, OSError):
+            proc, conn = self._replace(proc, conn)
+            raise ExtractionError("PDF worker crashed")
+        finally:
+            self._idle.put((proc, conn))
+        if status == "error":
+            raise ExtractionError(text)
+        return text, timings
+
+    def close(self):
+        for _ in range(self.workers):
+            proc, conn = self._idle.get()
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            proc.join(timeout=1)
+            if proc.is_alive():
+                proc.kill()
+
+# 4. RATE-LIMIT BACKOFF
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("429", "resource exhausted", "resource_exhausted", "rate limit", "503", "unavailable", "500 internal")
+
+def is_retryable(e):
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    try:
+        if int(code) in RETRYABLE_CODES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    msg = str(e).lower()
+    return any(m in msg for m in RETRYABLE_MARKERS)
+
+def invoke_with_backoff(llm, prompt, retries=5, base_delay=1.0, max_delay=30.0, on_retry=None, schema=None):
+    # With a schema, Gemini's structured-output mode constrains the reply to matching JSON
+    kwargs = {"response_mime_type": "application/json", "response_schema": schema} if schema else {}
+    for attempt in range(retries + 1):
+        try:
+            with metric_labels(retry=attempt):
+                return llm.invoke([HumanMessage(content=prompt)], **kwargs).content
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            # Full jitter so parallel workers don't retry in lockstep
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            time.sleep(delay)
+
+class Cancelled(Exception):
+    """Raised by stream_with_backoff when `cancelled()` turns true mid-stream."""
+
+def stream_with_backoff(llm, prompt, on_text, retries=5, base_delay=1.0, max_delay=30.0, on_retry=None, schema=None,
+                        cancelled=None):
+    """invoke_with_backoff that streams: `on_text(text_so_far)` is called as chunks arrive.
+
+    A retried call starts its text from scratch. Checking `cancelled()`
+    between chunks and closing the stream stops generation early, so the rest
+    of the response is never produced or billed.
+    """
+    kwargs = {"response_mime_type": "application/json", "response_schema": schema} if schema else {}
+    for attempt in range(retries + 1):
+        parts = []
+        try:
+            with metric_labels(retry=attempt):
+                stream = llm.stream([HumanMessage(content=prompt)], **kwargs)
+                try:
+                    for chunk in stream:
+                        if cancelled and cancelled():
+                            raise Cancelled()
+                        if chunk.content:
+                            parts.append(str(chunk.content))
+                            on_text("".join(parts))
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close:
+                        close()
+            return "".join(parts)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            time.sleep(delay)
+
+# 5. CONCURRENT INGESTION
+TERMINAL_STATES = ("done", "cached", "duplicate", "near-duplicate", "empty", "failed")
+
+def profile_budget(profile):
+    # Inverse of text_profile: the character budget a cached extraction was cut at (None = whole document)
+    budget = profile.split("-")[0]
+    return None if budget == "full" else int(budget)
+
+def cached_source_text(cache, digest, budget, skip_back_matter=False, source_profile=None, token_budget=CHUNK_TOKEN_BUDGET):
+    """Return (text, profile) of the best cached extraction for `budget`, or (None, None).
+
+    Any cached extraction at least as long as `budget` will do and is returned
+    as text_profile(budget). The one the paper was analysed from is the last
+    resort: if it was cut short of `budget` it comes back under its own,
+    shorter profile, so callers can tell the document was not fully covered.
+    """
+    wanted = text_profile(budget, skip_back_matter)
+    budgets = [budget] + [b for b in (None, extraction_budget("chunked", token_budget), MAX_PROMPT_CHARS) if b is None or (budget and b > budget)]
+    for profile in [text_profile(b, skip_back_matter) for b in budgets] + [source_profile]:
+        text = cache.get_text(digest, profile) if profile else None
+        if text is None:
+            continue
+        have = profile_budget(profile)
+        # Text shorter than its own budget is the whole document (or everything before the back matter)
+        if budget and have is not None and have < budget and len(text) >= have:
+            return text, profile
+        return (text[:budget] if budget else text), wanted
+    return None, None
+
+def analyse_document(llm, data, digest, emit, llm_slots, cache=None, model="", skip_back_matter=False, extractor=None,
+                     mode="truncate", token_budget=CHUNK_TOKEN_BUDGET, source_profile=None, stream=False, cancelled=None,
+                     ocr=None, near_duplicate=None, **backoff):
+    """Run one PDF through the result cache, text extraction and analysis.
+
+    `emit(state, payload)` receives progress events ("extracting", "extracted"
+    with the timing breakdown, "queued", "analysing", "retrying", and with
+    `stream=True` "partial" with the paper's response text so far); `llm_slots`
+    is a semaphore bounding concurrent model calls. `cancelled()` is checked
+    between streamed chunks (Cancelled is raised). Returns (state, paper) with
+    state "done", "cached" or "empty"; scanned PDFs go through `ocr` (an
+    ocr.OCRPool) when given. The paper is tagged with its provenance
+    (source hash, prompt version, model, text profile) and the MinHash
+    signature of its text ("_minhash"). If `near_duplicate(signature)` returns
+    a match, no model call is made and ("near-duplicate", match) is returned
+    instead. With `data=None` the
+    paper is re-analysed from cached text only (SourceTextMissing if evicted, or
+    if only an extract shorter than the mode reads is cached).
+    Exceptions propagate to the caller.
+    """
+    budget = extraction_budget(mode, token_budget)
+    profile = text_profile(budget, skip_back_matter)
+    version = prompt_version(mode)
+    def sign(text):
+        sig = signature(text) if text else None
+        return sig, (near_duplicate(sig) if near_duplicate and sig else None)
+
+    result = cache.get_result(digest, version, model) if cache else None
+    if result is not None:
+        sig, match = sign(cache.get_text(digest, profile))
+        if match:
+            return "near-duplicate", match
+        return "cached", {**result, **provenance(digest, mode, model, profile), **({"_minhash": sig} if sig else {})}
+    emit("extracting", None)
+    text = cache.get_text(digest, profile) if cache else None
+    if text is None and data is None:
+        text, cached_profile = cached_source_text(cache, digest, budget, skip_back_matter, source_profile, token_budget) if cache else (None, None)
+        if text is None:
+            raise SourceTextMissing("The extracted text is no longer cached; upload the PDF again to re-analyse it")
+        if cached_profile != profile:
+            # Only a truncated extract is cached: analysing it would cost a full run yet miss the rest of the paper
+            raise SourceTextMissing(f"Only the first {len(text):,} characters are cached; upload the PDF again to analyse the whole paper")
+    if text is None:
+        t0 = time.perf_counter()
+        try:
+            if extractor:
+                text, timings = extractor.extract(data, budget=budget, skip_back_matter=skip_back_matter)
+            else:
+                timings = {}
+                text = extract_text(data, budget=budget, skip_back_matter=skip_back_matter, timings=timings)
+        except Exception as e:
+            RECORDER.record("pdf", time.perf_counter() - t0, operation="extract", error=type(e).__name__)
+            raise
+        RECORDER.record("pdf", time.perf_counter() - t0, operation="extract", pages=timings.get("pages_read", 0),
+                        response_chars=len(text))
+        page_texts = timings.pop("page_texts", None)
+        if needs_ocr(timings):
+            if ocr is None:
+                if not text:
+                    raise ExtractionError("This PDF has no text layer (a scan?) and OCR is not enabled")
+            else:
+                # The first pass already found the blank pages, so the pool only parses and OCRs those
+                text, ocr_timings = ocr.extract(data, digest, page_texts=page_texts, pages_total=timings["pages_total"],
+                                                budget=budget, skip_back_matter=skip_back_matter, cache=cache)
+                timings.update(ocr_timings)
+        emit("extracted", timings)
+        if text and cache:
+            cache.put_text(digest, text, profile)
+    if not text:
+        return "empty", None
+    sig, match = sign(text)
+    if match:
+        return "near-duplicate", match
+    emit("queued", None)
+
+    def call(prompt, schema=None):
+        with llm_slots:
+            emit("analysing", None)
+            on_retry = lambda n, delay, e: emit("retrying", f"attempt {n}, waiting {delay:.1f}s")
+            if stream:
+                # Only the final call produces the paper; chunk notes stream just so they can be cancelled
+                on_text = (lambda text: emit("partial", text)) if schema is PAPER_SCHEMA else (lambda text: None)
+                return stream_with_backoff(llm, prompt, on_text, on_retry=on_retry, schema=schema, cancelled=cancelled, **backoff)
+            return invoke_with_backoff(llm, prompt, on_retry=on_retry, schema=schema, **backoff)
+
+    res = analyse_chunked(call, text, token_budget) if mode == "chunked" else call(build_prompt(text), PAPER_SCHEMA)
+    paper = parse_paper(res)
+    if cache:
+        cache.put_result(digest, version, model, paper)
+    return "done", {**paper, **provenance(digest, mode, model, profile), "_minhash": sig}
+
+def run_pipeline(llm, files, concurrency=4, extract_workers=4, skip_hashes=(), **options):
+    """Analyse (name, pdf_bytes) pairs concurrently.
+
+    Yields (name, state, payload) events on the calling thread so the caller can
+    update the UI and commit each paper as soon as it finishes. Terminal states
+    are "done" and "cached" (payload is the parsed paper), "duplicate" (the
+    bytes are in skip_hashes or earlier in the batch), "near-duplicate" (the
+    match, see analyse_document), "empty" and "failed"
+    (payload is the exception). `options` are passed to analyse_document, e.g.
+    cache, model, mode, extractor (an ExtractionPool to parse PDFs in worker
+    processes instead of threads).
+    """
+    events = queue.Queue()
+    llm_slots = threading.Semaphore(concurrency)
+
+    def work(name, data, digest):
+        try:
+            emit = lambda state, payload: events.put((name, state, payload))
+            events.put((name, *analyse_document(llm, data, digest, emit, llm_slots, **options)))
+        except Exception as e:
+            events.put((name, "failed", e))
+
+    if not files:
+        return
+    seen = set(skip_hashes)
+    with ThreadPoolExecutor(max_workers=max(extract_workers, concurrency)) as pool:
+        remaining = 0
+        for name, data in files:
+            digest = file_hash(data)
+            if digest in seen:
+                yield name, "duplicate", digest
+                continue
+            seen.add(digest)
+            pool.submit(propagate(work), name, data, digest)
+            remaining += 1
+        while remaining:
+            name, state, payload = events.get()
+            if state in TERMINAL_STATES:
+                remaining -= 1
+            yield name, state, payload
+
+# 6. OFFLINE TEST DOUBLE
+class RateLimitError(Exception):
+    code = 429
+
+class FakeMessage:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+class FakeLLM:
+    """Drop-in for ChatGoogleGenerativeAI that injects latency and 429s without network access."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None, response=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.response = response
+        self.calls = 0
+        self.prompt_chars = 0
+        self.response_chars = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def invoke(self, messages, response_mime_type=None, response_schema=None):
+        n, fail, prompt_chars = self._start(messages)
+        time.sleep(self.latency)
+        if fail:
+            raise RateLimitError("429 Resource exhausted (fake)")
+        return self._respond(n, prompt_chars, response_schema)
+
+    def stream(self, messages, response_mime_type=None, response_schema=None, chunk_chars=40):
+        # Same response as invoke, delivered in pieces with the latency spread over them; usage rides on the last piece
+        n, fail, prompt_chars = self._start(messages)
+        if fail:
+            time.sleep(self.latency)
+            raise RateLimitError("429 Resource exhausted (fake)")
+        message = self._respond(n, prompt_chars, response_schema)
+        pieces = [message.content[i:i + chunk_chars] for i in range(0, len(message.content), chunk_chars)] or [""]
+        for i, piece in enumerate(pieces):
+            time.sleep(self.latency / len(pieces))
+            yield FakeMessage(piece, message.usage_metadata if i == len(pieces) - 1 else None)
+
+    def _start(self, messages):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+            prompt_chars = sum(len(m.content) for m in messages)
+            self.prompt_chars += prompt_chars
+            return self.calls, fail, prompt_chars
+
+    def _respond(self, n, prompt_chars, response_schema):
+        content = self.response
+        if content is None and response_schema:
+            content = json.dumps({label: f"Fake {label.lower()} {n}." for label in response_schema["properties"]})
+        elif content is None:
+            content = "\n".join(f"[{label}]: Fake {key.lower()} {n}." for label, key in PAPER_FIELDS)
+        with self._lock:
+            self.response_chars += len(content)
+        usage = {"input_tokens": prompt_chars // CHARS_PER_TOKEN, "output_tokens": len(content) // CHARS_PER_TOKEN}
+        return FakeMessage(content, {**usage, "total_tokens": usage["input_tokens"] + usage["output_tokens"]})
+
+    @property
+    def tokens(self):
+        return (self.prompt_chars + self.response_chars) // CHARS_PER_TOKEN
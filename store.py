@@ -0,0 +1,557 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from minhash import LSH_BANDS, LSH_ROWS, bands, similarity
+
+# 1. SCHEMA
+DB_FILE = "buddy_projects.db"
+LEGACY_JSON_FILE = "buddy_projects.json"
+CACHE_FILE = "buddy_cache.db"
+METRICS_FILE = "buddy_metrics.db"
+MAX_TEXT_CACHE_BYTES = 512 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    last_accessed REAL NOT NULL DEFAULT 0,
+    synthesis TEXT,
+    settings TEXT,
+    revision INTEGER NOT NULL DEFAULT 0,
+    paper_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS papers_by_project ON papers(project_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# projects.paper_count lets the Library list projects without reading any paper rows
+PAPER_COUNT_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS papers_count_insert AFTER INSERT ON papers BEGIN
+    UPDATE projects SET paper_count = paper_count + 1 WHERE id = new.project_id;
+END;
+CREATE TRIGGER IF NOT EXISTS papers_count_delete AFTER DELETE ON papers BEGIN
+    UPDATE projects SET paper_count = paper_count - 1 WHERE id = old.project_id;
+END;
+"""
+
+# LSH index of the papers' MinHash signatures ("_minhash"): one row per band, so a near-duplicate lookup is
+# LSH_BANDS index probes however many papers are stored
+_BAND_SQL = (f"SELECT b.value, substr(json_extract(new.data, '$._minhash'), b.value * {LSH_ROWS * 8} + 1, {LSH_ROWS * 8}), "
+             f"new.id, new.project_id FROM json_each('{json.dumps(list(range(LSH_BANDS)))}') AS b")
+LSH_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS paper_lsh (
+    band INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    paper_id INTEGER NOT NULL REFERENCES papers(id) ON DELETE CASCADE,
+    project_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paper_lsh_by_bucket ON paper_lsh(band, bucket);
+CREATE INDEX IF NOT EXISTS paper_lsh_by_paper ON paper_lsh(paper_id);
+CREATE TRIGGER IF NOT EXISTS papers_lsh_insert AFTER INSERT ON papers
+WHEN json_extract(new.data, '$._minhash') IS NOT NULL BEGIN
+    INSERT INTO paper_lsh (band, bucket, paper_id, project_id) {_BAND_SQL};
+END;
+CREATE TRIGGER IF NOT EXISTS papers_lsh_update AFTER UPDATE OF data ON papers BEGIN
+    DELETE FROM paper_lsh WHERE paper_id = old.id;
+    INSERT INTO paper_lsh (band, bucket, paper_id, project_id) {_BAND_SQL} WHERE json_extract(new.data, '$._minhash') IS NOT NULL;
+END;
+"""
+
+# Keyword index over every project's papers, kept in step with the papers table by triggers
+SEARCH_BODY_FIELDS = ("Summary", "Background", "Methodology", "Context", "Findings", "Reliability", "Reference")
+_SEARCH_VALUES = ", ".join(
+    [f"COALESCE(json_extract(new.data, '$.{f}'), '')" for f in ("Title", "Authors", "Year")]
+    + [" || ' ' || ".join(f"COALESCE(json_extract(new.data, '$.{f}'), '')" for f in SEARCH_BODY_FIELDS)]
+)
+SEARCH_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS paper_search USING fts5(
+    title, authors, year, body, project_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS papers_search_insert AFTER INSERT ON papers BEGIN
+    INSERT INTO paper_search (rowid, title, authors, year, body, project_id) VALUES (new.id, {_SEARCH_VALUES}, new.project_id);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_search_update AFTER UPDATE OF data ON papers BEGIN
+    DELETE FROM paper_search WHERE rowid = old.id;
+    INSERT INTO paper_search (rowid, title, authors, year, body, project_id) VALUES (new.id, {_SEARCH_VALUES}, new.project_id);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_search_delete AFTER DELETE ON papers BEGIN
+    DELETE FROM paper_search WHERE rowid = old.id;
+END;
+"""
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS text_cache (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS text_cache_lru ON text_cache(last_used);
+CREATE TABLE IF NOT EXISTS result_cache (
+    hash TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (hash, prompt_version, model)
+);
+CREATE TABLE IF NOT EXISTS synthesis_cache (
+    key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (hash, page)
+);
+"""
+
+def load_legacy_json(path):
+    # Older files stored each project as a bare list of papers
+    with open(path, "r") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected an object of projects, found {type(data).__name__}")
+    projects = {}
+    for k, v in data.items():
+        if isinstance(v, list):
+            projects[k] = {"papers": v, "last_accessed": 0}
+        else:
+            projects[k] = v
+    return projects
+
+# 2. REPOSITORIES
+class ConflictError(Exception):
+    """A write was rejected because another session changed the same data first."""
+
+def merge_settings(base, mine, theirs):
+    """Three-way merge of settings dicts; returns (merged, conflicting keys).
+
+    Keys this session did not change keep the stored value, so edits to
+    different settings from different sessions never overwrite each other.
+    """
+    merged, conflicts = dict(theirs), []
+    for key in set(base) | set(mine):
+        if mine.get(key) == base.get(key):
+            continue
+        if theirs.get(key) not in (base.get(key), mine.get(key)):
+            conflicts.append(key)
+        elif key in mine:
+            merged[key] = mine[key]
+        else:
+            merged.pop(key, None)
+    return merged, sorted(conflicts)
+
+class SQLiteRepository:
+    schema = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.schema)
+
+    def _conn(self):
+        # One connection per thread; Streamlit serves each session on its own thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock before the first read, so read-modify-write
+        # sequences are atomic across sessions and processes sharing the database file
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+class ProjectStore(SQLiteRepository):
+    """SQLite-backed project/paper repository. Every write touches only the rows it changes."""
+    schema = SCHEMA
+
+    def __init__(self, path=DB_FILE, legacy_json=LEGACY_JSON_FILE):
+        super().__init__(path)
+        self._migrate()
+        self.legacy_json = legacy_json
+        self.legacy_error = None  # why buddy_projects.json could not be imported; retried on the next start
+        if legacy_json and os.path.exists(legacy_json):
+            self.retry_legacy_import()
+
+    def retry_legacy_import(self):
+        # A bad legacy file is reported rather than skipped, and stays importable once fixed
+        try:
+            self.import_legacy_json(self.legacy_json)
+            self.legacy_error = None
+        except (OSError, ValueError) as e:
+            self.legacy_error = f"{self.legacy_json} could not be imported ({e}); its projects are not in the library yet."
+        return self.legacy_error is None
+
+    def _migrate(self):
+        # Columns added after the first release of the SQLite store
+        with self._conn() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(projects)")}
+            if "settings" not in columns:
+                conn.execute("ALTER TABLE projects ADD COLUMN settings TEXT")
+            if "revision" not in columns:
+                conn.execute("ALTER TABLE projects ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+            if "paper_count" not in columns:
+                conn.execute("ALTER TABLE projects ADD COLUMN paper_count INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE projects SET paper_count = (SELECT COUNT(*) FROM papers WHERE project_id = projects.id)")
+            conn.executescript(PAPER_COUNT_TRIGGERS)
+            conn.executescript(LSH_SCHEMA)
+        try:
+            with self._conn() as conn:
+                conn.executescript(SEARCH_SCHEMA)
+                if not conn.execute("SELECT 1 FROM meta WHERE key = 'search_indexed'").fetchone():
+                    self._rebuild_search(conn)
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('search_indexed', ?)", (str(time.time()),))
+            self.search_enabled = True
+        except sqlite3.OperationalError:  # SQLite built without FTS5
+            self.search_enabled = False
+
+    def _rebuild_search(self, conn):
+        # Papers stored before the index existed; afterwards the triggers keep it current
+        conn.execute("DELETE FROM paper_search")
+        conn.execute(f"INSERT INTO paper_search (rowid, title, authors, year, body, project_id) "
+                     f"SELECT new.id, {_SEARCH_VALUES}, new.project_id FROM papers AS new")
+
+    def _project_id(self, conn, name):
+        row = conn.execute("SELECT id FROM projects WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def import_legacy_json(self, path):
+        """Copy the projects of a pre-SQLite JSON file into the store, once.
+
+        Raises OSError/ValueError if the file cannot be read or parsed; it is then
+        not marked imported, so the next attempt reads it again.
+        """
+        with self._conn() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return False
+        projects = load_legacy_json(path)
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return False  # imported by another process meanwhile
+            for name, proj in projects.items():
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO projects (name, last_accessed, synthesis) VALUES (?, ?, ?)",
+                    (name, proj.get("last_accessed", 0), json.dumps(proj["synthesis"]) if proj.get("synthesis") else None),
+                )
+                if not cur.rowcount:
+                    continue
+                conn.executemany(
+                    "INSERT INTO papers (project_id, data) VALUES (?, ?)",
+                    [(cur.lastrowid, json.dumps(p)) for p in proj.get("papers", [])],
+                )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (str(time.time()),))
+        return True
+
+    def _project_row(self, pid, name, last_accessed, synthesis, settings, revision):
+        proj = {"id": pid, "name": name, "revision": revision, "papers": [], "last_accessed": last_accessed,
+                "settings": json.loads(settings) if settings else {}}
+        if synthesis:
+            proj["synthesis"] = json.loads(synthesis)
+        return proj
+
+    def _paper_row(self, paper_id, data):
+        paper = json.loads(data)
+        paper["_id"] = paper_id
+        return paper
+
+    def load_all(self):
+        """Return every project in the in-memory shape the UI uses: {name: {"papers": [...], ...}}."""
+        conn = self._conn()
+        projects = {}
+        ids = {}
+        for row in conn.execute("SELECT id, name, last_accessed, synthesis, settings, revision FROM projects"):
+            projects[row[1]] = self._project_row(*row)
+            ids[row[0]] = row[1]
+        for paper_id, pid, data in conn.execute("SELECT id, project_id, data FROM papers ORDER BY id"):
+            projects[ids[pid]]["papers"].append(self._paper_row(paper_id, data))
+        return projects
+
+    def project_index(self):
+        """Return {name: {"id", "paper_count", "last_accessed", "revision"}}, most recently used first.
+
+        Reads only the projects table, so the Library stays fast however many papers are stored.
+        """
+        rows = self._conn().execute("SELECT id, name, paper_count, last_accessed, revision FROM projects ORDER BY last_accessed DESC")
+        return {name: {"id": pid, "paper_count": count, "last_accessed": last_accessed, "revision": revision}
+                for pid, name, count, last_accessed, revision in rows}
+
+    def load_project(self, name=None, project_id=None):
+        """Load one project with its papers, by name or by id; raises KeyError if it no longer exists."""
+        conn = self._conn()
+        # One read transaction, so the papers are exactly those of the revision returned
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT id, name, last_accessed, synthesis, settings, revision FROM projects WHERE "
+                               + ("name = ?" if project_id is None else "id = ?"), (name if project_id is None else project_id,)).fetchone()
+            if row is None:
+                raise KeyError(name if project_id is None else project_id)
+            proj = self._project_row(*row)
+            proj["papers"] = [self._paper_row(*r) for r in conn.execute("SELECT id, data FROM papers WHERE project_id = ? ORDER BY id", (row[0],))]
+        finally:
+            conn.commit()
+        return proj
+
+    def project_revision(self, project_id):
+        row = self._conn().execute("SELECT revision FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return row[0] if row else None
+
+    def source_hashes(self, project_id):
+        rows = self._conn().execute("SELECT json_extract(data, '$._source_hash') FROM papers WHERE project_id = ?", (project_id,))
+        return {h for (h,) in rows if h}
+
+    def create_project(self, name):
+        try:
+            with self._conn() as conn:
+                cur = conn.execute("INSERT INTO projects (name, last_accessed) VALUES (?, ?)", (name, time.time()))
+        except sqlite3.IntegrityError:
+            raise ConflictError(f"A project named '{name}' already exists.") from None
+        return cur.lastrowid
+
+    def rename_project(self, old, new):
+        with self._transaction() as conn:
+            if old != new and conn.execute("SELECT 1 FROM projects WHERE name = ?", (new,)).fetchone():
+                raise ConflictError(f"A project named '{new}' already exists.")
+            # The revision moves so sessions with the project open notice the new name
+            row = conn.execute("UPDATE projects SET name = ?, revision = revision + 1 WHERE name = ? RETURNING id", (new, old)).fetchone()
+            if row is None:
+                raise ConflictError(f"'{old}' was renamed or deleted in another session.")
+        return row[0]
+
+    def delete_project(self, name):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM projects WHERE name = ?", (name,))
+
+    def touch_project(self, name, when=None):
+        with self._conn() as conn:
+            conn.execute("UPDATE projects SET last_accessed = ? WHERE name = ?", (when or time.time(), name))
+
+    def set_synthesis(self, name, synthesis, expected_revision=None):
+        """Store the synthesis; with expected_revision, only if no paper was added or removed since (compare-and-swap).
+
+        Returns False when the swap failed, so a slow synthesis of an older paper
+        set cannot overwrite a newer one saved by another session.
+        """
+        sql, params = "UPDATE projects SET synthesis = ? WHERE name = ?", [json.dumps(synthesis), name]
+        if expected_revision is not None:
+            sql += " AND revision = ?"
+            params.append(expected_revision)
+        with self._conn() as conn:
+            return conn.execute(sql, params).rowcount > 0
+
+    def set_settings(self, name, settings, base=None):
+        """Store settings and return what was stored.
+
+        With `base` (the settings this session loaded), changes are merged into
+        the stored settings key by key; ConflictError is raised when another
+        session changed the same key to a different value.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT settings FROM projects WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise ConflictError(f"'{name}' was renamed or deleted in another session.")
+            if base is not None:
+                settings, conflicts = merge_settings(base, settings, json.loads(row[0]) if row[0] else {})
+                if conflicts:
+                    raise ConflictError(f"Changed in another session: {', '.join(conflicts)}.")
+            conn.execute("UPDATE projects SET settings = ? WHERE name = ?", (json.dumps(settings), name))
+        return settings
+
+    def add_paper(self, name, paper):
+        """Insert one paper and return its row id (also stored on the dict as "_id")."""
+        with self._conn() as conn:
+            pid = self._project_id(conn, name)
+        return self.add_paper_by_id(pid, paper)
+
+    def add_paper_by_id(self, project_id, paper):
+        # Papers added without a "#" (e.g. by background jobs) are numbered after the highest existing one
+        with self._transaction() as conn:
+            if "#" not in paper:
+                paper["#"] = conn.execute("SELECT COALESCE(MAX(CAST(json_extract(data, '$.\"#\"') AS INTEGER)), 0) + 1 "
+                                          "FROM papers WHERE project_id = ?", (project_id,)).fetchone()[0]
+            record = {k: v for k, v in paper.items() if k != "_id"}
+            cur = conn.execute("INSERT INTO papers (project_id, data) VALUES (?, ?)", (project_id, json.dumps(record)))
+            conn.execute("UPDATE projects SET last_accessed = ?, revision = revision + 1 WHERE id = ?", (time.time(), project_id))
+        paper["_id"] = cur.lastrowid
+        return cur.lastrowid
+
+    def replace_paper(self, paper_id, paper):
+        """Overwrite a paper's analysis in place, keeping its number. Returns False if it was deleted meanwhile."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT project_id, data FROM papers WHERE id = ?", (paper_id,)).fetchone()
+            if row is None:
+                return False
+            record = {k: v for k, v in paper.items() if k != "_id"}
+            record["#"] = json.loads(row[1]).get("#")
+            conn.execute("UPDATE papers SET data = ? WHERE id = ?", (json.dumps(record), paper_id))
+            conn.execute("UPDATE projects SET revision = revision + 1 WHERE id = ?", (row[0],))
+        return True
+
+    def delete_paper(self, paper_id):
+        """Returns False if another session already deleted the paper."""
+        with self._conn() as conn:
+            conn.execute("UPDATE projects SET revision = revision + 1 WHERE id = (SELECT project_id FROM papers WHERE id = ?)", (paper_id,))
+            return conn.execute("DELETE FROM papers WHERE id = ?", (paper_id,)).rowcount > 0
+
+    def near_duplicates(self, sig, threshold, project_id=None, limit=5):
+        """Stored papers (in one project, or all) whose MinHash similarity to `sig` is at least `threshold`.
+
+        Candidates are the papers sharing an LSH band with `sig`; only those are
+        compared in full. Returns dicts with paper_id, project, #, Title and
+        similarity, most similar first.
+        """
+        keys = bands(sig)
+        # Joined from the keys so each band is one probe of paper_lsh_by_bucket
+        sql = (f"SELECT DISTINCT l.paper_id FROM (VALUES {', '.join(['(?, ?)'] * len(keys))}) AS k "
+               "JOIN paper_lsh AS l ON l.band = k.column1 AND l.bucket = k.column2")
+        params = [v for key in keys for v in key]
+        if project_id is not None:
+            sql += " WHERE l.project_id = ?"
+            params.append(project_id)
+        conn = self._conn()
+        ids = [i for (i,) in conn.execute(sql, params)]
+        if not ids:
+            return []
+        rows = conn.execute(
+            "SELECT p.id, pr.name, json_extract(p.data, '$.\"#\"'), json_extract(p.data, '$.Title'), json_extract(p.data, '$._minhash') "
+            f"FROM papers AS p JOIN projects AS pr ON pr.id = p.project_id WHERE p.id IN ({', '.join('?' * len(ids))})", ids)
+        matches = [{"paper_id": i, "project": name, "#": number, "Title": title, "similarity": similarity(sig, other)}
+                   for i, name, number, title, other in rows]
+        return sorted((m for m in matches if m["similarity"] >= threshold), key=lambda m: -m["similarity"])[:limit]
+
+    def unsigned_papers(self):
+        # Papers stored before MinHash signatures were recorded at ingest
+        rows = self._conn().execute("SELECT id, json_extract(data, '$._source_hash'), json_extract(data, '$._text_profile') FROM papers "
+                                    "WHERE json_extract(data, '$._minhash') IS NULL AND json_extract(data, '$._source_hash') IS NOT NULL")
+        return rows.fetchall()
+
+    def set_signature(self, paper_id, sig):
+        # Bookkeeping only: no revision bump, the paper as shown is unchanged
+        with self._conn() as conn:
+            conn.execute("UPDATE papers SET data = json_set(data, '$._minhash', ?) WHERE id = ?", (sig, paper_id))
+
+    def search(self, query, limit=50, project_id=None):
+        """Rank papers across all projects (or one) by BM25 for a free-text query.
+
+        Every word must appear in the title, authors, year or analysis; FTS5
+        operators in user input are not interpreted.
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms or not self.search_enabled:
+            return []
+        # The last word is matched as a prefix so results follow the user's typing
+        match = " ".join(f'"{t}"' for t in terms) + "*"
+        sql = ("SELECT s.rowid, p.name, s.title, s.authors, s.year, snippet(paper_search, 3, '**', '**', ' … ', 12) "
+               "FROM paper_search AS s JOIN projects AS p ON p.id = s.project_id WHERE paper_search MATCH ?")
+        params = [match]
+        if project_id is not None:
+            sql += " AND s.project_id = ?"
+            params.append(project_id)
+        rows = self._conn().execute(sql + " ORDER BY bm25(paper_search, 10.0, 5.0, 2.0, 1.0) LIMIT ?", (*params, limit))
+        keys = ("paper_id", "project", "Title", "Authors", "Year", "snippet")
+        return [{**dict(zip(keys, r)), "snippet": " ".join(r[5].split())} for r in rows]
+
+class ExtractionCache(SQLiteRepository):
+    """Content-addressed cache: PDF SHA-256 -> extracted text (LRU, size-bounded), -> OCR text per page and
+    -> parsed analysis, plus synthesis tree nodes keyed by a hash of their inputs."""
+    schema = CACHE_SCHEMA
+
+    def __init__(self, path=CACHE_FILE, max_text_bytes=MAX_TEXT_CACHE_BYTES):
+        super().__init__(path)
+        self.max_text_bytes = max_text_bytes
+
+    def get_text(self, digest, profile=""):
+        digest = f"{digest}:{profile}" if profile else digest
+        with self._conn() as conn:
+            row = conn.execute("SELECT text FROM text_cache WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE text_cache SET last_used = ? WHERE hash = ?", (time.time(), digest))
+        return row[0]
+
+    def put_text(self, digest, text, profile=""):
+        digest = f"{digest}:{profile}" if profile else digest
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO text_cache (hash, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (digest, text, len(text.encode("utf-8")), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM text_cache").fetchone()[0]
+        excess = total - self.max_text_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for digest, size in conn.execute("SELECT hash, size FROM text_cache ORDER BY last_used"):
+            if excess <= 0:
+                break
+            stale.append((digest,))
+            excess -= size
+        conn.executemany("DELETE FROM text_cache WHERE hash = ?", stale)
+
+    def get_result(self, digest, prompt_version, model):
+        row = self._conn().execute(
+            "SELECT result FROM result_cache WHERE hash = ? AND prompt_version = ? AND model = ?",
+            (digest, str(prompt_version), model),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_result(self, digest, prompt_version, model, result):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (hash, prompt_version, model, result, created) VALUES (?, ?, ?, ?, ?)",
+                (digest, str(prompt_version), model, json.dumps(result), time.time()),
+            )
+
+    def get_summary(self, key):
+        row = self._conn().execute("SELECT summary FROM synthesis_cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_summary(self, key, summary):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO synthesis_cache (key, summary, created) VALUES (?, ?, ?)",
+                (key, summary, time.time()),
+            )
+
+    def get_ocr_pages(self, digest):
+        # Not evicted with the text cache: OCR costs seconds per page, its text a few KB
+        return dict(self._conn().execute("SELECT page, text FROM ocr_cache WHERE hash = ?", (digest,)))
+
+    def put_ocr_page(self, digest, page, text, seconds):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO ocr_cache (hash, page, text, seconds) VALUES (?, ?, ?, ?)",
+                         (digest, page, text, seconds))
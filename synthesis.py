@@ -0,0 +1,107 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import propagate
+from pipeline import invoke_with_backoff, stream_with_backoff, json_schema, parse_labelled
+
+# 1. PROMPTS
+SYNTH_PROMPT_VERSION = 3
+SYNTH_SECTIONS = ["OVERVIEW", "PATTERNS", "CONTRADICTIONS", "FUTURE"]
+SYNTH_SCHEMA = json_schema(SYNTH_SECTIONS)
+SYNTH_LABELS = "Respond with a JSON object with the keys OVERVIEW, PATTERNS, CONTRADICTIONS and FUTURE."
+SYNTH_FANOUT = 8
+SYNTH_DIRECT_CHARS = 30000  # evidence below this size is synthesised in a single call
+
+def leaf_prompt(evidence):
+    return f"Act as PhD Supervisor. Synthesize these findings critically. {SYNTH_LABELS} Evidence: {evidence}"
+
+def merge_prompt(partials):
+    joined = "\n\n".join(f"Partial synthesis {i + 1}:\n{p}" for i, p in enumerate(partials))
+    return (
+        "Act as PhD Supervisor. Merge these partial syntheses of disjoint groups of papers into one critical "
+        f"synthesis of the whole body of evidence. Keep paper numbers when citing. {SYNTH_LABELS} {joined}"
+    )
+
+def parse_synthesis(raw):
+    return parse_labelled(raw, SYNTH_SECTIONS, "Analysis pending.")
+
+def evidence_line(paper):
+    return f"Paper {paper.get('#')}: {paper.get('Findings')}\n"
+
+# 2. TREE REDUCE
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def group_by_content(keys, fanout=SYNTH_FANOUT):
+    """Split keys into runs whose boundaries depend only on each key's own hash.
+
+    Inserting or deleting one item therefore changes only the group it lands in,
+    so every other group keeps its cached summary.
+    """
+    groups, current = [], []
+    for key in keys:
+        current.append(key)
+        if int(key[:8], 16) % fanout == 0 or len(current) >= 2 * fanout:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    if len(groups) == len(keys) > 1:
+        # Pathological run of boundaries: fall back to fixed-size groups so the tree still shrinks
+        groups = [keys[i:i + fanout] for i in range(0, len(keys), fanout)]
+    return groups
+
+def synthesize(llm, papers, cache=None, model="", fanout=SYNTH_FANOUT, concurrency=4, force=False, on_progress=None,
+               on_text=None, cancelled=None):
+    """Return the raw OVERVIEW/PATTERNS/CONTRADICTIONS/FUTURE synthesis of `papers` (see parse_synthesis).
+
+    Large projects are reduced as a tree: groups of papers are summarised into
+    partial syntheses, which are merged level by level up to a single root.
+    Every node is cached by a hash of its inputs, so adding one paper only
+    recomputes the nodes on the path from its group to the root.
+
+    With `on_text`, the root call is streamed on the calling thread and
+    `on_text(text_so_far)` sees it as it arrives (see stream_with_backoff for
+    `cancelled`); the levels below it are not streamed.
+    """
+    scope = f"{SYNTH_PROMPT_VERSION}|{model}"
+    lines = [evidence_line(p) for p in papers]
+
+    def run(level):
+        # level: list of (key, prompt); returns {key: summary}
+        done = {}
+        todo = []
+        for key, prompt in level:
+            cached = None if force or not cache else cache.get_summary(key)
+            if cached is None:
+                todo.append((key, prompt))
+            else:
+                done[key] = cached
+        if len(level) == 1 and todo and on_text:
+            key, prompt = todo[0]
+            done[key] = stream_with_backoff(llm, prompt, on_text, schema=SYNTH_SCHEMA, cancelled=cancelled)
+            if cache:
+                cache.put_summary(key, done[key])
+        elif todo:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(todo))) as pool:
+                for (key, _), summary in zip(todo, pool.map(propagate(lambda kp: invoke_with_backoff(llm, kp[1], schema=SYNTH_SCHEMA)), todo)):
+                    done[key] = summary
+                    if cache:
+                        cache.put_summary(key, summary)
+        if on_progress:
+            on_progress(len(todo), len(level))
+        return done
+
+    if sum(len(line) for line in lines) <= SYNTH_DIRECT_CHARS:
+        key = _digest(scope, "direct", *lines)
+        return run([(key, leaf_prompt("".join(lines)))])[key]
+
+    line_keys = [_digest(line) for line in lines]
+    by_key = dict(zip(line_keys, lines))
+    level = [(_digest(scope, "leaf", *g), leaf_prompt("".join(by_key[k] for k in g))) for g in group_by_content(line_keys, fanout)]
+    summaries = run(level)
+    while len(level) > 1:
+        level = [(_digest(scope, "merge", *g), merge_prompt([summaries[k] for k in g]))
+                 for g in group_by_content([key for key, _ in level], fanout)]
+        summaries = run(level)
+    return summaries[level[0][0]]
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import synthetic_pdf
+from jobs import JobQueue
+from store import ExtractionCache, ProjectStore
+
+@pytest.fixture
+def store(tmp_path):
+    return ProjectStore(str(tmp_path / "projects.db"), legacy_json=None)
+
+@pytest.fixture
+def queue(store):
+    # Shares the project database, as in the app
+    return JobQueue(store.path)
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / "cache.db"))
+
+@pytest.fixture
+def project_id(store):
+    return store.create_project("Review")
+
+@pytest.fixture
+def pdfs():
+    return [(f"paper{i}.pdf", synthetic_pdf(3, seed=i)) for i in range(4)]
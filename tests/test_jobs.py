@@ -0,0 +1,193 @@
+"""Background job queue and ingestion pipeline, run offline against FakeLLM with injected 429s."""
+import threading
+import time
+
+from jobs import MAX_ATTEMPTS, JobWorker, retry_delay
+from pipeline import FakeLLM, RateLimitError, file_hash, run_pipeline
+
+FAST_BACKOFF = {"base_delay": 0.001, "max_delay": 0.01}
+
+def job_states(queue, project_id):
+    return {job["id"]: job for job in queue.project_jobs(project_id)}
+
+# 1. QUEUE
+def test_claim_takes_each_job_once_in_order(queue, project_id, pdfs):
+    ids = queue.enqueue(project_id, pdfs[:2])
+    first, second = queue.claim(), queue.claim()
+    assert [first["id"], second["id"]] == ids
+    assert first["attempts"] == 1 and first["data"] == pdfs[0][1]
+    assert queue.claim() is None
+    assert {j["state"] for j in job_states(queue, project_id).values()} == {"extracting"}
+
+def test_enqueue_skips_files_already_queued_or_stored(queue, project_id, pdfs):
+    assert len(queue.enqueue(project_id, pdfs[:2] + [("copy.pdf", pdfs[0][1])])) == 2
+    assert queue.enqueue(project_id, pdfs[:2]) == []
+    stored = {file_hash(pdfs[2][1])}
+    assert len(queue.enqueue(project_id, pdfs[2:], skip_hashes=stored)) == 1
+
+def test_fail_backs_off_then_parks_the_job(queue, project_id, pdfs):
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    job = queue.claim()
+    queue.fail(job_id, "429 Resource exhausted", job["attempts"])
+    job = job_states(queue, project_id)[job_id]
+    assert job["state"] == "queued" and job["error"] == "429 Resource exhausted"
+    assert queue.claim() is None  # not due until the backoff has passed
+    run_after = queue._conn().execute("SELECT run_after FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert run_after >= time.time() + retry_delay(1) - 5
+
+    queue.fail(job_id, "429 Resource exhausted", MAX_ATTEMPTS)
+    assert job_states(queue, project_id)[job_id]["state"] == "failed"
+
+def test_non_retryable_failure_is_not_requeued(queue, project_id, pdfs):
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    queue.fail(job_id, "Malformed PDF", queue.claim()["attempts"], retryable=False)
+    assert job_states(queue, project_id)[job_id]["state"] == "failed"
+
+def test_retry_requeues_with_merged_options(queue, project_id, pdfs):
+    [job_id] = queue.enqueue(project_id, pdfs[:1], {"mode": "truncate"})
+    queue.fail(job_id, "boom", queue.claim()["attempts"], retryable=False)
+    queue.retry(job_id, allow_near_duplicate=True)
+    job = queue.claim()
+    assert job["id"] == job_id and job["attempts"] == 1
+    assert job["options"] == {"mode": "truncate", "allow_near_duplicate": True}
+
+def test_retry_needs_the_pdf_bytes(queue, project_id, pdfs):
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    queue.claim()
+    queue.complete(job_id)  # drops the bytes
+    queue.retry(job_id)
+    assert job_states(queue, project_id)[job_id]["state"] == "done"
+
+def test_cancelled_job_stays_cancelled(queue, project_id, pdfs):
+    queued, running = queue.enqueue(project_id, pdfs[:2])
+    queue.claim()
+    queue.cancel(queued)
+    queue.cancel(running)
+    # A worker finishing or failing the job afterwards must not revive it
+    queue.set_state(running, "analysing")
+    queue.fail(running, "429", 1)
+    states = job_states(queue, project_id)
+    assert states[queued]["state"] == states[running]["state"] == "cancelled"
+    assert queue.claim() is None and queue.active_count(project_id) == 0
+
+    queue.retry(running)
+    assert queue.claim()["id"] == running
+
+def test_dismiss_drops_failed_and_cancelled_jobs_with_their_bytes(queue, project_id, pdfs):
+    failed, cancelled, running = queue.enqueue(project_id, pdfs[:3])
+    queue.fail(failed, "Malformed PDF", queue.claim()["attempts"], retryable=False)
+    queue.cancel(cancelled)
+    queue.claim()
+    for job_id in (failed, cancelled, running):
+        queue.dismiss(job_id)
+    assert list(job_states(queue, project_id)) == [running]  # active jobs can't be dismissed
+    assert queue._conn().execute("SELECT COUNT(*) FROM jobs WHERE data IS NOT NULL").fetchone()[0] == 1
+
+def test_recover_requeues_jobs_interrupted_mid_flight(queue, project_id, pdfs):
+    extracting, analysing, done = queue.enqueue(project_id, pdfs[:3])
+    for _ in range(3):
+        queue.claim()
+    queue.set_state(analysing, "analysing")
+    queue.complete(done)
+    queue.recover()
+    states = job_states(queue, project_id)
+    assert states[extracting]["state"] == states[analysing]["state"] == "queued"
+    assert states[done]["state"] == "done"
+    assert {queue.claim()["id"], queue.claim()["id"]} == {extracting, analysing}
+
+# 2. WORKER
+def test_worker_commits_papers_despite_rate_limits(store, queue, cache, project_id, pdfs):
+    llm = FakeLLM(error_rate=0.5, seed=3)
+    worker = JobWorker(llm, store, queue, cache=cache, model="fake", retries=20, **FAST_BACKOFF)
+    queue.enqueue(project_id, pdfs)
+    while (job := queue.claim()) is not None:
+        worker.process(job)
+    papers = store.load_project(project_id=project_id)["papers"]
+    assert len(papers) == len(pdfs)
+    assert all(p["Title"].startswith("Fake title") and p["_model"] == "fake" for p in papers)
+    assert [p["#"] for p in papers] == [1, 2, 3, 4]
+    assert llm.calls > len(pdfs)  # some calls were rejected with 429 and retried
+    assert {j["state"] for j in queue.project_jobs(project_id)} == {"done"}
+
+def test_worker_requeues_when_retries_run_out(store, queue, project_id, pdfs):
+    llm = FakeLLM(error_rate=1.0)
+    worker = JobWorker(llm, store, queue, retries=1, **FAST_BACKOFF)
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    worker.process(queue.claim())
+    job = job_states(queue, project_id)[job_id]
+    assert job["state"] == "queued" and "429" in job["error"]
+    assert llm.calls == 2
+    assert store.load_project(project_id=project_id)["papers"] == []
+
+def test_worker_skips_papers_already_in_the_project(store, queue, cache, project_id, pdfs):
+    worker = JobWorker(FakeLLM(), store, queue, cache=cache)
+    queue.enqueue(project_id, pdfs[:1])
+    worker.process(queue.claim())
+    [again] = queue.enqueue(project_id, pdfs[:1])  # queued without skip_hashes, as a second session might
+    worker.process(queue.claim())
+    assert job_states(queue, project_id)[again]["note"] == "duplicate"
+    [paper] = store.load_project(project_id=project_id)["papers"]
+    assert paper["_source_hash"] == file_hash(pdfs[0][1])
+
+def test_cancel_stops_a_streaming_job(store, queue, project_id, pdfs):
+    llm = FakeLLM(latency=2.0)
+    worker = JobWorker(llm, store, queue, stream=True)
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    job = queue.claim()
+    threading.Timer(0.5, worker.cancel, [job_id]).start()
+    started = time.perf_counter()
+    worker.process(job)
+    assert time.perf_counter() - started < 1.5  # the stream was closed, not read to the end
+    assert job_states(queue, project_id)[job_id]["state"] == "cancelled"
+    assert store.load_project(project_id=project_id)["papers"] == []
+
+def test_worker_threads_fill_every_model_call_slot(store, queue, project_id, pdfs):
+    in_flight, peak, lock = [0], [0], threading.Lock()
+
+    class CountingLLM(FakeLLM):
+        def invoke(self, *args, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            try:
+                return super().invoke(*args, **kwargs)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+    worker = JobWorker(CountingLLM(latency=0.3), store, queue, concurrency=4, poll_interval=0.05)
+    queue.enqueue(project_id, pdfs)
+    worker.start()
+    try:
+        deadline = time.monotonic() + 10
+        while queue.active_count(project_id) and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        worker.stop()
+    assert len(store.load_project(project_id=project_id)["papers"]) == len(pdfs)
+    assert peak[0] == 4
+
+def test_cancel_before_the_job_starts_is_not_overridden(store, queue, project_id, pdfs):
+    worker = JobWorker(FakeLLM(), store, queue)
+    [job_id] = queue.enqueue(project_id, pdfs[:1])
+    job = queue.claim()
+    worker.cancel(job_id)  # between claim() and process(): the worker has not registered the job yet
+    worker.process(job)
+    assert job_states(queue, project_id)[job_id]["state"] == "cancelled"
+    assert store.load_project(project_id=project_id)["papers"] == []
+
+# 3. CONCURRENT PIPELINE
+def test_run_pipeline_retries_rate_limited_calls(pdfs):
+    llm = FakeLLM(error_rate=0.5, seed=11)
+    events = list(run_pipeline(llm, pdfs + [("copy.pdf", pdfs[0][1])], concurrency=2, retries=20, **FAST_BACKOFF))
+    finished = {name: state for name, state, _ in events if state in ("done", "duplicate", "failed")}
+    assert finished == {**{name: "done" for name, _ in pdfs}, "copy.pdf": "duplicate"}
+    assert any(state == "retrying" for _, state, _ in events)
+    assert llm.calls > len(pdfs)
+
+def test_run_pipeline_reports_exhausted_retries(pdfs):
+    llm = FakeLLM(error_rate=1.0)
+    events = list(run_pipeline(llm, pdfs[:1], retries=2, **FAST_BACKOFF))
+    name, state, error = events[-1]
+    assert state == "failed" and isinstance(error, RateLimitError)
+    assert llm.calls == 3
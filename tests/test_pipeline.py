@@ -0,0 +1,53 @@
+"""Re-analysis from cached extracted text."""
+import threading
+
+import pytest
+
+from bench import synthetic_pdf
+from jobs import JobWorker
+from pipeline import (MAX_PROMPT_CHARS, FakeLLM, SourceTextMissing, analyse_document, cached_source_text, extraction_budget,
+                      file_hash, text_profile)
+
+def analyse(cache, data, digest, mode, **options):
+    return analyse_document(FakeLLM(), data, digest, lambda *a: None, threading.Semaphore(4), cache=cache, model="fake",
+                            mode=mode, **options)
+
+def test_chunked_reanalysis_refuses_truncated_text(cache):
+    data = synthetic_pdf(60, seed=3)
+    digest = file_hash(data)
+    _, paper = analyse(cache, data, digest, "truncate")
+    text, profile = cached_source_text(cache, digest, extraction_budget("chunked"), source_profile=paper["_text_profile"])
+    assert profile == paper["_text_profile"] == text_profile(MAX_PROMPT_CHARS)
+    with pytest.raises(SourceTextMissing, match="Only the first"):
+        analyse(cache, None, digest, "chunked", source_profile=paper["_text_profile"])
+
+def test_reuploading_a_stale_paper_reanalyses_it_in_place(store, queue, cache, project_id):
+    data = synthetic_pdf(60, seed=3)
+    worker = JobWorker(FakeLLM(), store, queue, cache=cache, model="fake")
+    queue.enqueue(project_id, [("long.pdf", data)], {"mode": "truncate"})
+    worker.process(queue.claim())
+    [paper] = store.load_project(project_id=project_id)["papers"]
+
+    # From cached text alone the chunked re-run is refused...
+    [job_id] = queue.enqueue_reanalysis(project_id, [paper], {"mode": "chunked"})
+    worker.process(queue.claim())
+    assert "Only the first" in queue.project_jobs(project_id)[0]["error"]
+    queue.dismiss(job_id)
+
+    # ...but with the PDF uploaded again it is re-extracted at the chunked budget and the paper updated in place
+    assert queue.enqueue(project_id, [("long.pdf", data)], skip_hashes=store.source_hashes(project_id)) == []
+    queue.enqueue_reanalysis(project_id, [paper], {"mode": "chunked"}, data={paper["_id"]: data})
+    worker.process(queue.claim())
+    [updated] = store.load_project(project_id=project_id)["papers"]
+    assert (updated["_id"], updated["#"]) == (paper["_id"], paper["#"])
+    assert updated["_prompt_version"].endswith("-chunked")
+    assert updated["_text_profile"] == text_profile(extraction_budget("chunked"))
+    assert queue.project_jobs(project_id)[0]["state"] == "done"
+
+def test_chunked_reanalysis_runs_when_the_whole_paper_is_cached(cache):
+    data = synthetic_pdf(3, seed=3)  # shorter than the truncate budget, so nothing was cut
+    digest = file_hash(data)
+    _, paper = analyse(cache, data, digest, "truncate")
+    state, paper = analyse(cache, None, digest, "chunked", source_profile=paper["_text_profile"])
+    assert state == "done"
+    assert paper["_text_profile"] == text_profile(extraction_budget("chunked")) and paper["_prompt_version"].endswith("-chunked")
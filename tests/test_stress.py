@@ -0,0 +1,6 @@
+"""Concurrent sessions editing the same projects (the `python bench.py stress` scenario, kept short)."""
+from bench import bench_stress
+
+def test_concurrent_sessions_keep_store_invariants():
+    # Separate processes add, delete, rename and edit; revision, paper_count, numbering and the search index must agree
+    assert bench_stress(sessions=4, seconds=2, projects=2)